@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of pydjango's own overhead.
+
+Generates a synthetic Django project with N models, M database aliases
+and K tests split into plain test functions, TestCase and
+TransactionTestCase methods, plus a live server throughput test. Every
+scenario runs pytest on it a few times and reports median timings as
+JSON:
+
+* ``startup``: plugin import, ``DjangoPlugin.configure`` and collection
+* ``flush``/``snapshot``: test database setup, per test setup, call and
+  teardown time and savepoint/rollback time by kind of test,
+  ``restore_database`` and live server requests per second. Restores are
+  forced after every module of transaction tests, a synthetic schedule the
+  plugin doesn't use (``synthetic`` in the results), unless
+  ``--real-restores`` is given
+* ``sqlite-fast``/``sqlite-tmpfs``: the same with ``--sqlite-fast`` (and
+  database files in /dev/shm), reported as speedups over ``flush`` too
+* ``threadpool``: ``flush`` with the thread pool live server, which reports
+  request latencies too
+
+Usage::
+
+    python benchmarks/bench.py --models 20 --aliases 2 --tests 300 -o bench.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+import django
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+TMPFS = '/dev/shm/pydjango-bench'
+
+# share of plain, TestCase and TransactionTestCase tests
+SPLIT = (0.6, 0.3, 0.1)
+# transaction tests per module
+TRANSACTION_MODULE = 5
+
+SCENARIOS = {
+    'startup': ['--collect-only'],
+    'flush': ['--create-db', '--restore-db=flush'],
+    'snapshot': ['--create-db', '--restore-db=snapshot'],
+    'sqlite-fast': ['--create-db', '--restore-db=flush', '--sqlite-fast'],
+    'sqlite-tmpfs': ['--create-db', '--restore-db=flush', '--sqlite-fast', '--sqlite-dir=%s' % TMPFS],
+    'threadpool': ['--create-db', '--restore-db=flush',
+                   '--liveserver-class=pydjango.live_server_helper.ThreadPoolWSGIServer'],
+}
+
+# scenario -> the one its speedup is measured against
+BASELINES = {
+    'sqlite-fast': 'flush',
+    'sqlite-tmpfs': 'flush',
+}
+
+SETTINGS = '''
+import os
+DIR = os.path.dirname(os.path.abspath(__file__))
+SECRET_KEY = 'bench'
+DEBUG = False
+USE_TZ = True
+ALLOWED_HOSTS = ['*']
+ROOT_URLCONF = 'benchurls'
+STATIC_URL = '/static/'
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+MIDDLEWARE = ['django.middleware.common.CommonMiddleware']
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.staticfiles',
+    'benchapp',
+]
+DATABASES = {}
+for index, alias in enumerate(%(aliases)r):
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(DIR, '%%s.sqlite3' %% alias),
+        'TEST': {'NAME': os.path.join(DIR, 'test_%%s.sqlite3' %% alias), 'DEPENDENCIES': []},
+    }
+'''
+
+MODEL = '''
+
+class Model%(index)d(models.Model):
+    name = models.CharField(max_length=50)
+    value = models.IntegerField(default=0)
+    parent = %(parent)s
+'''
+
+URLS = '''
+from django.http import HttpResponse
+from django.urls import path
+
+from benchapp.models import Model0
+
+
+def count(request):
+    return HttpResponse(str(Model0.objects.count()))
+
+
+urlpatterns = [path('count/', count)]
+'''
+
+TEST_BODY = '''
+    obj = Model%(model)d.objects.using(%(alias)r).create(name='test', value=%(index)d)
+    assert Model%(model)d.objects.using(%(alias)r).filter(pk=obj.pk).exists()
+'''
+
+LIVE_TEST = '''
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REQUESTS = %(requests)d
+CONCURRENCY = %(concurrency)d
+
+
+def fetch(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def test_throughput(live_server, bench_record):
+    urls = [live_server.url + '/count/'] * REQUESTS
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CONCURRENCY) as executor:
+        list(executor.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+    bench_record['live_server'] = {
+        'requests': REQUESTS,
+        'concurrency': CONCURRENCY,
+        'seconds': elapsed,
+        'requests_per_second': REQUESTS / elapsed,
+        'latency': live_server.stats,
+    }
+'''
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content.lstrip())
+
+
+def generate_project(directory, models, aliases, tests, requests, concurrency):
+    """Write the synthetic project into ``directory``"""
+    aliases = ['default'] + ['db%d' % index for index in range(1, aliases)]
+    write(os.path.join(directory, 'benchsettings.py'), SETTINGS % {'aliases': aliases})
+    write(os.path.join(directory, 'benchurls.py'), URLS)
+    os.mkdir(os.path.join(directory, 'benchapp'))
+    write(os.path.join(directory, 'benchapp', '__init__.py'), '')
+    source = ['from django.db import models\n']
+    for index in range(models):
+        parent = 'None'
+        if index:
+            parent = "models.ForeignKey('Model%d', null=True, on_delete=models.CASCADE)" % (index - 1)
+        source.append(MODEL % {'index': index, 'parent': parent})
+    write(os.path.join(directory, 'benchapp', 'models.py'), ''.join(source))
+
+    imports = 'from benchapp.models import %s\n' % ', '.join('Model%d' % i for i in range(models))
+    counts = [int(tests * share) for share in SPLIT]
+    counts[0] += tests - sum(counts)
+    offset = 0
+
+    plain = [imports]
+    for index in range(offset, offset + counts[0]):
+        plain.append('\n\ndef test_%d():' % index)
+        plain.append(TEST_BODY % {'model': index % models, 'alias': aliases[index % len(aliases)],
+                                  'index': index})
+    offset += counts[0]
+    write(os.path.join(directory, 'test_plain.py'), ''.join(plain))
+
+    modules = [('testcase', 'TestCase', counts[1])]
+    # the database is restored once a module of transaction tests is done
+    for number, start in enumerate(range(0, counts[2], TRANSACTION_MODULE)):
+        modules.append(('transaction_%d' % number, 'TransactionTestCase',
+                        min(TRANSACTION_MODULE, counts[2] - start)))
+    for name, base, count in modules:
+        source = ['from django.test import %s\n' % base, imports,
+                  '\n\nclass Bench%s(%s):\n    databases = %r\n' % (base, base, set(aliases))]
+        for index in range(offset, offset + count):
+            source.append('\n    def test_%d(self):' % index)
+            source.append(TEST_BODY.replace('\n    ', '\n        ') % {
+                'model': index % models, 'alias': aliases[index % len(aliases)], 'index': index})
+        offset += count
+        write(os.path.join(directory, 'test_%s.py' % name), ''.join(source))
+
+    write(os.path.join(directory, 'test_live.py'),
+          LIVE_TEST % {'requests': requests, 'concurrency': concurrency})
+
+
+def plugin_args():
+    """Load pydjango explicitly unless it is installed as a pytest plugin"""
+    try:
+        from importlib.metadata import entry_points
+        installed = any(ep.name == 'pydjango' for ep in entry_points(group='pytest11'))
+    except Exception:
+        installed = False
+    return [] if installed else ['-p', 'pydjango.plugin']
+
+
+def run_scenario(directory, args, force_restore=True):
+    output = os.path.join(directory, 'probe.json')
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': os.pathsep.join([directory, HERE, ROOT, env.get('PYTHONPATH', '')]),
+        'DJANGO_SETTINGS_MODULE': 'benchsettings',
+        'BENCH_OUTPUT': output,
+    })
+    if force_restore:
+        env['BENCH_FORCE_RESTORE'] = '1'
+    command = [sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+               '-p', 'probe'] + plugin_args() + ['--django-settings=benchsettings'] + args
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=directory, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    wall = time.perf_counter() - start
+    if process.returncode not in (0, 5):
+        sys.stderr.write(process.stdout.decode('utf-8', 'replace'))
+        raise SystemExit('pytest %s failed' % ' '.join(args))
+    with open(output) as f:
+        result = json.load(f)
+    result['wall'] = wall
+    return summarize(result)
+
+
+def summarize(result):
+    """Turn totals into per test means"""
+    restore = result.pop('restore')
+    result['restore'] = {
+        'count': len(restore),
+        'mean': statistics.mean(restore) if restore else None,
+        'synthetic': result.pop('restore_forced'),
+    }
+    for kind, totals in result['tests'].items():
+        count = totals.pop('count') or 1
+        result['tests'][kind] = dict((name, value / count) for name, value in totals.items())
+        result['tests'][kind]['count'] = count
+    return result
+
+
+def speedups(scenarios):
+    """How many times faster scenarios ran than their baselines"""
+    found = {}
+    for name, baseline in sorted(BASELINES.items()):
+        if name not in scenarios or baseline not in scenarios:
+            continue
+        result, base = scenarios[name], scenarios[baseline]
+        found[name] = {
+            'baseline': baseline,
+            'wall': base['wall'] / result['wall'],
+            'db_setup': base['db_setup'] / result['db_setup'] if result['db_setup'] else None,
+        }
+        for kind, timings in result['tests'].items():
+            if kind in base['tests']:
+                total = sum(timings[phase] for phase in ('setup', 'call', 'teardown'))
+                base_total = sum(base['tests'][kind][phase] for phase in ('setup', 'call', 'teardown'))
+                found[name][kind] = base_total / total if total else None
+    return found
+
+
+def median(results):
+    """Median of every number found at the same place in ``results``"""
+    first = results[0]
+    if isinstance(first, dict):
+        return dict((key, median([result.get(key) for result in results])) for key in first)
+    numbers = [result for result in results if isinstance(result, (int, float))]
+    if numbers and not isinstance(first, bool):
+        return statistics.median(numbers)
+    return first
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--models', type=int, default=20)
+    parser.add_argument('--aliases', type=int, default=1)
+    parser.add_argument('--tests', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='live server requests')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='parallel live server requests')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--real-restores', action='store_false', dest='force_restore',
+                        help='only restore databases when the plugin would, '
+                             'instead of after every transaction module')
+    parser.add_argument('--scenario', action='append', default=None, metavar='NAME[=ARGS]',
+                        help='scenario to run, with extra pytest arguments for new ones. '
+                             'default: %s' % ', '.join(sorted(SCENARIOS)))
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the generated project')
+    options = parser.parse_args(argv)
+
+    scenarios = {}
+    default = [name for name in sorted(SCENARIOS)
+               if name != 'sqlite-tmpfs' or os.path.isdir(os.path.dirname(TMPFS))]
+    for scenario in options.scenario or default:
+        name, _, args = scenario.partition('=')
+        scenarios[name] = args.split() if args else SCENARIOS[name]
+
+    directory = tempfile.mkdtemp(prefix='pydjango-bench-')
+    try:
+        generate_project(directory, options.models, options.aliases, options.tests,
+                         options.requests, options.concurrency)
+        report = {
+            'versions': {
+                'python': sys.version.split()[0],
+                'django': django.get_version(),
+                'pytest': pytest.__version__,
+            },
+            'parameters': {
+                'models': options.models,
+                'aliases': options.aliases,
+                'tests': options.tests,
+                'requests': options.requests,
+                'concurrency': options.concurrency,
+                'repeat': options.repeat,
+            },
+            'scenarios': {},
+        }
+        for name, args in sorted(scenarios.items()):
+            runs = [run_scenario(directory, args, options.force_restore)
+                    for _ in range(options.repeat)]
+            report['scenarios'][name] = median(runs)
+            report['scenarios'][name]['args'] = args
+        report['speedups'] = speedups(report['scenarios'])
+    finally:
+        if options.keep:
+            sys.stderr.write('project kept in %s\n' % directory)
+        else:
+            shutil.rmtree(directory)
+        shutil.rmtree(TMPFS, ignore_errors=True)
+
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
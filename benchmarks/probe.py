@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""pytest plugin recording where pydjango spends time, used by bench.py.
+
+Django is set up first so importing pydjango measures the plugin alone.
+Results are written as JSON to the file named by ``BENCH_OUTPUT``.
+"""
+
+import json
+import os
+import time
+from functools import wraps
+
+import pytest
+import django
+
+django.setup()
+
+start = time.perf_counter()
+import pydjango.plugin  # noqa
+from pydjango import django_plugin  # noqa
+from pydjango.durations import USER_PROPERTY  # noqa
+IMPORT_TIME = time.perf_counter() - start
+
+results = {
+    'import': IMPORT_TIME,
+    'configure': None,
+    'db_setup': None,
+    'restore': [],
+    'restore_forced': bool(os.environ.get('BENCH_FORCE_RESTORE')),
+    'tests': {},
+}
+
+
+def timed(method, record):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            record(time.perf_counter() - start)
+    return wrapper
+
+
+def record_db_setup(duration):
+    # later calls return right away
+    if results['db_setup'] is None:
+        results['db_setup'] = duration
+
+
+Plugin = django_plugin.DjangoPlugin
+Plugin.configure = timed(Plugin.configure, lambda d: results.__setitem__('configure', d))
+Plugin.ensure_databases = timed(Plugin.ensure_databases, record_db_setup)
+Plugin.restore_database = timed(Plugin.restore_database, results['restore'].append)
+
+
+def needs_restore(self, item, nextitem):
+    # once its savepoint layers are gone, a restore may end the session
+    # transaction
+    leaving = nextitem is None or nextitem.module != item.module
+    return self.is_transaction_item(item) and leaving
+
+
+if results['restore_forced']:
+    # restore after every transaction module, not just before other tests.
+    # The plugin runs transaction tests last and hardly ever restores, this
+    # is a synthetic schedule measuring the restore itself
+    Plugin.needs_restore = needs_restore
+
+
+def test_kind(nodeid):
+    module = nodeid.split('::')[0]
+    name = os.path.splitext(os.path.basename(module))[0].replace('test_', '', 1)
+    # test_transaction_3.py -> transaction
+    return name.rstrip('0123456789').rstrip('_')
+
+
+def pytest_runtest_logreport(report):
+    kind = results['tests'].setdefault(test_kind(report.nodeid), {
+        'count': 0, 'setup': 0.0, 'call': 0.0, 'teardown': 0.0,
+        'savepoint': 0.0, 'rollback': 0.0})
+    kind[report.when] += report.duration
+    if report.when == 'setup':
+        kind['count'] += 1
+    for name, value in report.user_properties:
+        if name == USER_PROPERTY:
+            kind['savepoint'] += value['savepoint']
+            kind['rollback'] += value['rollback']
+
+
+@pytest.fixture(scope='session')
+def bench_record():
+    """Dict of extra results tests want to report"""
+    return results.setdefault('extra', {})
+
+
+def pytest_sessionfinish(session):
+    path = os.environ.get('BENCH_OUTPUT')
+    if path:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
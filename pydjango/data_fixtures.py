@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Data fixtures loaded in bulk.
+
+Fixture files are looked up like ``loaddata`` does, parsed once per
+session and their rows inserted with ``bulk_create``, models referenced
+by foreign keys first. As ``bulk_create`` is used, no ``pre_save`` or
+``post_save`` signals are sent for the rows.
+"""
+
+import os
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+SCOPES = ('function', 'class', 'module')
+
+
+def fixture_dirs():
+    dirs = [os.path.join(app_config.path, 'fixtures') for app_config in apps.get_app_configs()]
+    return dirs + [str(path) for path in settings.FIXTURE_DIRS] + ['']
+
+
+def find_fixture(label):
+    """Return the path and serialization format of fixture ``label``"""
+    formats = serializers.get_public_serializer_formats()
+    name, ext = os.path.splitext(label)
+    if ext[1:] in formats:
+        candidates = [(label, ext[1:])]
+    else:
+        candidates = [('%s.%s' % (label, fmt), fmt) for fmt in formats]
+    if os.path.isabs(label):
+        dirs = ['']
+    else:
+        dirs = fixture_dirs()
+    for directory in dirs:
+        for name, fmt in candidates:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return os.path.abspath(path), fmt
+    raise CommandError("No fixture named '%s' found." % label)
+
+
+def dependency_order(models):
+    """Sort ``models`` so the ones referenced by foreign keys come first"""
+    pending = list(models)
+    ordered = []
+    while pending:
+        for model in pending:
+            depends = set(field.related_model._meta.concrete_model
+                          for field in model._meta.concrete_fields
+                          if field.many_to_one or field.one_to_one)
+            depends &= set(pending)
+            depends.discard(model)
+            if not depends:
+                break
+        else:
+            # circular references, the database checks them at commit
+            model = pending[0]
+        pending.remove(model)
+        ordered.append(model)
+    return ordered
+
+
+class FixtureData(object):
+    """Rows of a fixture file grouped by model"""
+
+    def __init__(self, path, fmt, using=DEFAULT_DB_ALIAS):
+        self.path = path
+        # model -> list of field values
+        self.rows = OrderedDict()
+        # model -> list of (m2m field, pk, related pks)
+        self.m2m = OrderedDict()
+        # forward references to be resolved by loaddata itself
+        self.deferred = False
+        with open(path, 'rb') as stream:
+            objects = serializers.deserialize(fmt, stream, using=using,
+                                              handle_forward_references=True)
+            for obj in objects:
+                if obj.deferred_fields:
+                    self.deferred = True
+                    break
+                self.add(obj)
+
+    def add(self, deserialized):
+        obj = deserialized.object
+        model = obj.__class__
+        self.rows.setdefault(model, []).append(dict(
+            (field.attname, getattr(obj, field.attname))
+            for field in model._meta.concrete_fields))
+        for name, pks in (deserialized.m2m_data or {}).items():
+            field = model._meta.get_field(name)
+            self.m2m.setdefault(model, []).append((field, obj.pk, pks))
+
+    def load(self, using=DEFAULT_DB_ALIAS):
+        if self.deferred:
+            call_command('loaddata', self.path, database=using, verbosity=0)
+            return
+        connection = connections[using]
+        models = dependency_order(self.rows)
+        with connection.constraint_checks_disabled():
+            for model in models:
+                objs = [model(**values) for values in self.rows[model]]
+                if model._meta.parents:
+                    # bulk_create can't insert into multi-table inherited models
+                    for obj in objs:
+                        obj.save_base(raw=True, using=using)
+                else:
+                    model._base_manager.using(using).bulk_create(objs)
+            for model, relations in self.m2m.items():
+                self.load_m2m(relations, using)
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), models)
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+
+    def load_m2m(self, relations, using):
+        through_rows = OrderedDict()
+        for field, pk, related_pks in relations:
+            through = field.remote_field.through
+            source = through._meta.get_field(field.m2m_field_name()).attname
+            target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            through_rows.setdefault(through, []).extend(
+                through(**{source: pk, target: related_pk}) for related_pk in related_pks)
+        for through, objs in through_rows.items():
+            through._base_manager.using(using).bulk_create(objs)
+
+
+class DataFixtures(object):
+    """Fixture files parsed once per session"""
+
+    def __init__(self):
+        # label -> (path, format)
+        self.found = {}
+        # (path, alias) -> FixtureData
+        self.parsed = {}
+
+    def find(self, label):
+        if label not in self.found:
+            self.found[label] = find_fixture(label)
+        return self.found[label][0]
+
+    def load(self, labels, using=DEFAULT_DB_ALIAS):
+        for label in labels:
+            self.find(label)
+            path, fmt = self.found[label]
+            if (path, using) not in self.parsed:
+                self.parsed[path, using] = FixtureData(path, fmt, using)
+            self.parsed[path, using].load(using)
@@ -4,12 +4,19 @@ The code in this module is heavily inspired by django-nose:
 https://github.com/jbalogh/django-nose/
 """
 
+import os
+import sqlite3
+import threading
 import types
+from contextlib import contextmanager
 
 from django.conf import settings
+from django.core import management
 from django.db import connections, transaction
 from django.db.backends.sqlite3.base import DatabaseOperations as BDO
 
+from .fingerprint import (reuse_strategy, write_fingerprint, fresh_fingerprint, schema_cache_key,
+                          REUSE, MIGRATE)
 from .utils import nop
 
 
@@ -17,27 +24,52 @@ def can_support_db_reuse(connection):
     """Return whether it makes any sense to use REUSE_DB with the backend of a connection."""
     # This is a SQLite in-memory DB. Those are created implicitly when
     # you try to connect to them, so our test below doesn't work.
-    return connection.creation._get_test_db_name() != ':memory:'
+    test_db_name = connection.creation._get_test_db_name()
+    is_in_memory_db = getattr(connection.creation, 'is_in_memory_db', None)
+    if is_in_memory_db is not None:
+        return not is_in_memory_db(test_db_name)
+    return test_db_name != ':memory:'
 
 
-def test_database_exists_from_previous_run(connection):
-    # Check for sqlite memory databases
-    if not can_support_db_reuse(connection):
-        return False
+def can_clone_test_db(connection):
+    """Return whether a test database can be cloned from a template"""
+    return connection.vendor in ('postgresql', 'sqlite') and can_support_db_reuse(connection)
 
-    # Try to open a cursor to the test database
+
+@contextmanager
+def test_database_connection(connection):
+    """Temporarily point ``connection`` at its test database"""
     orig_db_name = connection.settings_dict['NAME']
     connection.settings_dict['NAME'] = connection.creation._get_test_db_name()
     try:
-        connection.cursor()
-        return True
-    except Exception:
-        return False
+        yield connection
     finally:
         connection.close()
         connection.settings_dict['NAME'] = orig_db_name
 
 
+def test_database_exists_from_previous_run(connection):
+    # Check for sqlite memory databases
+    if not can_support_db_reuse(connection):
+        return False
+
+    # Try to open a cursor to the test database
+    with test_database_connection(connection):
+        try:
+            connection.cursor()
+            return True
+        except Exception:
+            return False
+
+
+def test_database_strategy_from_previous_run(connection):
+    """Return how to reuse the test database of a previous run, if at all"""
+    if not test_database_exists_from_previous_run(connection):
+        return None
+    with test_database_connection(connection):
+        return reuse_strategy(connection)
+
+
 def create_test_db(self, verbosity=1, autoclobber=False, serialize=False, keepdb=False):
     """
     This method is a monkey patched version of create_test_db that
@@ -58,26 +90,175 @@ def create_test_db(self, verbosity=1, autoclobber=False, serialize=False, keepdb
         # django < 1.5
         self.connection.features.confirm()
 
+    if getattr(self, 'db_migrate', False):
+        if verbosity >= 1:
+            print("Applying missing migrations for alias '%s'..." % self.connection.alias)
+        settings.DATABASES[self.connection.alias]['NAME'] = test_database_name
+        management.call_command('migrate', verbosity=max(verbosity - 1, 0),
+                                interactive=False, database=self.connection.alias,
+                                run_syncdb=True)
+        write_fingerprint(self.connection)
+
+    return test_database_name
+
+
+def fingerprinted(create_test_db):
+    """Store the schema fingerprint in databases built by ``create_test_db``"""
+    def wrapper(self, *args, **kwargs):
+        test_database_name = create_test_db(*args, **kwargs)
+        write_fingerprint(self.connection)
+        return test_database_name
+    return wrapper
+
+
+def cached_schema(create_test_db, directory):
+    """Copy databases built by ``create_test_db`` from snapshots kept in
+    ``directory`` across runs, keyed by their alias and schema fingerprint.
+
+    SQLite snapshots are database files restored with the backup API,
+    in-memory databases included. PostgreSQL ones are template databases
+    on the server. Other backends are always built.
+    """
+    def wrapper(self, verbosity=1, autoclobber=False, serialize=True, keepdb=False):
+        connection = self.connection
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return create_test_db(self, verbosity=verbosity, autoclobber=autoclobber,
+                                  serialize=serialize, keepdb=keepdb)
+        key = schema_cache_key(connection, fresh_fingerprint(connection))
+        if connection.vendor == 'sqlite':
+            snapshot = os.path.join(str(directory), '%s.sqlite3' % key)
+            cached = os.path.exists(snapshot)
+        else:
+            snapshot = 'pydjango_schema_%s' % key[:16]
+            with nodb_cursor(connection) as cursor:
+                cursor.execute('SELECT 1 FROM pg_database WHERE datname = %s', [snapshot])
+                cached = cursor.fetchone() is not None
+
+        if not cached:
+            test_database_name = create_test_db(self, verbosity=verbosity, autoclobber=autoclobber,
+                                                serialize=serialize, keepdb=keepdb)
+            if connection.vendor == 'sqlite':
+                partial = '%s.%d' % (snapshot, os.getpid())
+                target = sqlite3.connect(partial)
+                try:
+                    connection.ensure_connection()
+                    connection.connection.backup(target)
+                finally:
+                    target.close()
+                os.replace(partial, snapshot)
+            else:
+                # a template must not be in use while it is copied
+                connection.close()
+                copy_database(connection, test_database_name, snapshot)
+            return test_database_name
+
+        if verbosity >= 1:
+            print("Copying test database for alias '%s' from schema cache..." % connection.alias)
+        if connection.vendor == 'sqlite':
+            test_database_name = self._create_test_db(verbosity, autoclobber, keepdb)
+        else:
+            test_database_name = self._get_test_db_name()
+            connection.close()
+            copy_database(connection, snapshot, test_database_name)
+        connection.close()
+        settings.DATABASES[connection.alias]['NAME'] = test_database_name
+        connection.settings_dict['NAME'] = test_database_name
+        if connection.vendor == 'sqlite':
+            source = sqlite3.connect(snapshot)
+            try:
+                connection.ensure_connection()
+                source.backup(connection.connection)
+            finally:
+                source.close()
+        if serialize:
+            connection._test_serialized_contents = self.serialize_db_to_string()
+        connection.ensure_connection()
+        return test_database_name
+    return wrapper
+
+
+def clone_test_db(self, verbosity=1, autoclobber=False, serialize=False, keepdb=False):
+    """
+    This method is a monkey patched version of create_test_db that
+    will copy the template database built by the xdist controller
+    instead of creating and migrating a new one.
+    """
+    test_database_name = self._get_test_db_name()
+    if verbosity >= 1:
+        print("Cloning test database for alias '%s' from '%s'..." % (
+            self.connection.alias, self.db_template))
+
+    self.connection.close()
+    if self.connection.vendor == 'sqlite':
+        source = sqlite3.connect(self.db_template)
+        target = sqlite3.connect(test_database_name)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    else:
+        copy_database(self.connection, self.db_template, test_database_name)
+
+    settings.DATABASES[self.connection.alias]['NAME'] = test_database_name
+    self.connection.settings_dict['NAME'] = test_database_name
     return test_database_name
 
 
+def copy_database(connection, template, name):
+    """Create PostgreSQL database ``name`` from ``template``, replacing it"""
+    qn = connection.ops.quote_name
+    with nodb_cursor(connection) as cursor:
+        cursor.execute("DROP DATABASE IF EXISTS %s" % qn(name))
+        cursor.execute("CREATE DATABASE %s WITH TEMPLATE %s" % (qn(name), qn(template)))
+
+
+def nodb_cursor(connection):
+    if hasattr(connection, '_nodb_cursor'):
+        return connection._nodb_cursor()
+    # django < 3.1
+    return connection._nodb_connection.cursor()
+
+
 def _get_test_db_name(self):
     name = super(self.__class__, self)._get_test_db_name()
     return name + self.db_postfix
 
 
-def monkey_patch_creation_for_db_reuse(db_postfix, force=False):
+def monkey_patch_creation_for_db_reuse(db_postfix, force=False, template=False, schema_cache=None,
+                                       template_postfix=''):
+    """Patch database creation of every alias.
+
+    ``db_postfix`` is appended to test database names. With ``template``
+    a database which doesn't exist yet (or is forced to be recreated) is
+    cloned from the test database named with ``template_postfix`` instead
+    of being migrated.
+    Databases left from a previous run are reused according to their
+    schema fingerprint. Other ones are copied from a snapshot in the
+    ``schema_cache`` directory when given.
+    """
     for alias in connections:
         connection = connections[alias]
         creation = connection.creation
-        if db_postfix:
+        clone = False
+        if db_postfix and can_support_db_reuse(connection):
+            creation.db_template = creation._get_test_db_name() + template_postfix
             creation.db_postfix = db_postfix
             creation._get_test_db_name = types.MethodType(_get_test_db_name, creation)
-        if test_database_exists_from_previous_run(connection):
-            # Make sure our monkey patch is still valid in the future
-            assert hasattr(creation, 'create_test_db')
-            if not force:
-                creation.create_test_db = types.MethodType(create_test_db, creation)
+            clone = template and can_clone_test_db(connection)
+        # Make sure our monkey patch is still valid in the future
+        assert hasattr(creation, 'create_test_db')
+        strategy = None if force else test_database_strategy_from_previous_run(connection)
+        if strategy == REUSE or (strategy == MIGRATE and not clone):
+            creation.db_migrate = strategy == MIGRATE
+            creation.create_test_db = types.MethodType(create_test_db, creation)
+        elif clone:
+            creation.create_test_db = types.MethodType(clone_test_db, creation)
+        else:
+            create = fingerprinted(creation.create_test_db)
+            if schema_cache is not None:
+                create = cached_schema(create, schema_cache)
+            creation.create_test_db = types.MethodType(create, creation)
 
 
 class BaseDatabaseOperations(BDO):
@@ -92,6 +273,24 @@ class BaseDatabaseOperations(BDO):
         return "ROLLBACK TO SAVEPOINT %s" % sid
 
 
+def begin_session_transaction(connection):
+    """Start the transaction every test of the session runs in"""
+    connection.set_autocommit(
+        False, force_begin_transaction_with_broken_autocommit=True
+    )
+    connection.in_atomic_block = True
+
+
+def end_session_transaction(connection):
+    connection.in_atomic_block = False
+    transaction.rollback(using=connection.alias)
+
+
+# held while using the test connections, which threads of live servers
+# share with the tests
+CONNECTION_LOCK = threading.RLock()
+
+
 def wrap_database():
     connections._connections = connections._connections.default
     for db in connections.all():
@@ -101,10 +300,39 @@ def wrap_database():
             options.update({'isolation_level': None})
             settings.DATABASES[db.alias]['OPTIONS'] = options
             db.features.uses_savepoints = True
-            db.ops = BaseDatabaseOperations(db.alias)
+            db.ops = BaseDatabaseOperations(db)
         if hasattr(db, 'inc_thread_sharing'):
             db.inc_thread_sharing()
         else:
             db.allow_thread_sharing = True
         db.abort = nop
         db.close_if_unusable_or_obsolete = nop
+
+
+SQLITE_FAST_PRAGMAS = (
+    'PRAGMA journal_mode = MEMORY',
+    'PRAGMA synchronous = OFF',
+    # in KiB when negative
+    'PRAGMA cache_size = -65536',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+def sqlite_fast_pragmas(sender, connection, **kwargs):
+    """``connection_created`` receiver trading durability of SQLite
+    databases for speed, a crash may corrupt them"""
+    if connection.vendor == 'sqlite':
+        # straight on the DB-API connection, cursors start savepoints
+        for pragma in SQLITE_FAST_PRAGMAS:
+            connection.connection.execute(pragma)
+
+
+def move_sqlite_databases(directory):
+    """Keep files of SQLite test databases in ``directory``, e.g. on tmpfs"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for db in connections.all():
+        if db.vendor == 'sqlite' and can_support_db_reuse(db):
+            test_settings = db.settings_dict['TEST']
+            test_settings['NAME'] = os.path.join(
+                directory, os.path.basename(db.creation._get_test_db_name()))
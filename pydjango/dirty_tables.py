@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Tracking of tables written to by transaction tests.
+
+Only those tables need to be cleaned up afterwards and nothing at all
+when a test didn't write anything.
+"""
+
+import re
+
+from django.db import connections
+
+
+WRITE_RE = re.compile(
+    r'^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)'
+    r'\s+[`"\[]?([\w$]+)',
+    re.IGNORECASE
+)
+
+
+def written_table(sql):
+    """Return the table an INSERT, UPDATE or DELETE statement writes to"""
+    match = WRITE_RE.match(sql)
+    return match and match.group(1)
+
+
+class DirtyTables(object):
+
+    def __init__(self):
+        # alias -> names of written tables
+        self.tables = {}
+        self.wrappers = {}
+
+    def wrapper(self, alias):
+        def track(execute, sql, params, many, context):
+            table = written_table(sql)
+            if table:
+                self.tables.setdefault(alias, set()).add(table)
+            return execute(sql, params, many, context)
+        return track
+
+    def install(self):
+        for alias in connections:
+            if alias not in self.wrappers:
+                self.wrappers[alias] = self.wrapper(alias)
+                connections[alias].execute_wrappers.append(self.wrappers[alias])
+
+    def uninstall(self):
+        for alias, wrapper in self.wrappers.items():
+            connections[alias].execute_wrappers.remove(wrapper)
+        self.wrappers = {}
+
+    def pop(self):
+        """Return and forget the written tables of every alias"""
+        tables, self.tables = self.tables, {}
+        return tables
@@ -1,28 +1,76 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import time
 from functools import partial
 from importlib import import_module
 
 import pytest
 
 from django.conf import settings
-from django.db import connections, transaction, InternalError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
 from django.core import management, mail
 from django.test.runner import DiscoverRunner
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 
-from .db_reuse import monkey_patch_creation_for_db_reuse, wrap_database
-from .fixtures import Fixtures
-from .utils import is_transaction_test, nop
+from .data_fixtures import DataFixtures, SCOPES as FIXTURE_SCOPES
+from .dirty_tables import DirtyTables
+from .durations import Durations, USER_PROPERTY
+from .db_reuse import (monkey_patch_creation_for_db_reuse, wrap_database,
+                       begin_session_transaction, end_session_transaction,
+                       sqlite_fast_pragmas, move_sqlite_databases, can_clone_test_db)
+from .fixtures import Fixtures, DjangoApps
+from .live_server_helper import ThreadPoolWSGIServer
+from .parallel import setup_databases as parallel_setup_databases
+from .pool import DatabasePool, pool_postfix
+from .queries import QueryRecorder, QueryCounter, QueryBaseline
+from .savepoints import LazySavepoints, RECOVERIES_PROPERTY
+from .schema import DisableMigrations, verify_schema
+from .sessions import SessionSeeder
+from .snapshot import database_snapshot
+from .utils import is_transaction_test, nop, get_worker_id, is_xdist_controller
+
+
+FAST_PASSWORD_HASHER = 'django.contrib.auth.hashers.MD5PasswordHasher'
+
+# workerinput key of the database pool slot claimed by the controller
+POOL_SLOT = 'pydjango_pool_slot'
+# tests marked or requesting these get databases set up before they run,
+# others once they open a cursor
+DATABASE_MARKERS = ('django_db', 'transaction', 'max_queries', 'django_fixtures')
+DATABASE_FIXTURES = ('test_user', 'admin_user', 'uclient', 'aclient', 'live_server', 'driver')
 
 
 class DjangoPlugin(Fixtures):
 
     def __init__(self, config):
         self.config = config
+        self.is_controller = is_xdist_controller(config)
+        self.is_worker = bool(get_worker_id(config))
+        self.durations = Durations(config)
+        # the pool slot is claimed once test databases are needed
+        self.pool = None
+        self.pool_slot = None
         self.check_markers()
         self.configure()
         self.original_connection_close = {}
+        self.savepoints = LazySavepoints(begin=self.begin_transaction)
+        self.dirty_tables = DirtyTables()
+        self.session_seeder = SessionSeeder()
+        self.django_apps = DjangoApps()
+        self.data_fixtures = DataFixtures()
+        # savepoint layer -> (path, alias) pairs of data fixtures its savepoint holds
+        self.loaded_fixtures = {}
+        # savepoints recovered from, reported by tests of every worker
+        self.recoveries = []
+        self.queries = QueryRecorder() if config.option.queries else None
+        self.query_baseline = None
+        if config.option.queries_baseline:
+            self.query_baseline = QueryBaseline(config.option.queries_baseline,
+                                                config.option.queries_baseline_update)
         try:
             self.live_server_class = import_module(config.option.liveserver_class)
         except ImportError:
@@ -31,6 +79,39 @@ class DjangoPlugin(Fixtures):
                 import_module('.'.join(liveserver_class[:-1])),
                 liveserver_class[-1]
             )
+        threads = config.option.liveserver_threads
+        if (threads and isinstance(self.live_server_class, type) and
+                issubclass(self.live_server_class, ThreadPoolWSGIServer)):
+            self.live_server_class = type(self.live_server_class.__name__,
+                                          (self.live_server_class, ), {'threads': threads})
+
+    def claim_pool_slot(self):
+        """Take the database pool slot of the run, xdist workers get the
+        one of their controller.
+        """
+        if not self.config.option.db_pool or self.pool_slot is not None:
+            return
+        if self.is_worker:
+            self.pool_slot = self.config.workerinput[POOL_SLOT]
+            return
+        self.pool = DatabasePool(self.config.option.db_pool, self.config.option.db_pool_size)
+
+        def wait(pool):
+            sys.stderr.write('pydjango: all %d database pool slots in %s are taken, waiting...\n' % (
+                pool.size, pool.directory))
+        try:
+            self.pool_slot = self.pool.claim(wait=wait)
+        except RuntimeError as e:
+            pytest.exit(str(e), returncode=pytest.ExitCode.USAGE_ERROR)
+
+    def pytest_unconfigure(self, config):
+        if self.pool is not None:
+            self.pool.release()
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_configure_node(self, node):
+        if self.pool_slot is not None:
+            node.workerinput[POOL_SLOT] = self.pool_slot
 
     def check_markers(self):
         self.skip_trans = False
@@ -44,85 +125,398 @@ class DjangoPlugin(Fixtures):
             verbosity=self.config.option.verbose
         )
         self.runner.setup_test_environment()
+        if self.config.option.fast_hasher:
+            # stored hashes of other algorithms still verify
+            override_settings(PASSWORD_HASHERS=[FAST_PASSWORD_HASHER] + [
+                hasher for hasher in settings.PASSWORD_HASHERS if hasher != FAST_PASSWORD_HASHER
+            ]).enable()
+        if self.config.option.nomigrations:
+            if self.config.option.verify_schema:
+                raise pytest.UsageError('--verify-schema checks migrations, drop --nomigrations')
+            override_settings(MIGRATION_MODULES=DisableMigrations()).enable()
         management.get_commands()  # load all commands first
-        is_sqlite = settings.DATABASES.get('default', {}).get('ENGINE', '')\
-                            .endswith('sqlite3')
+        if self.config.option.sqlite_fast:
+            connection_created.connect(sqlite_fast_pragmas)
+        if self.config.option.sqlite_dir:
+            move_sqlite_databases(self.config.option.sqlite_dir)
         wrap_database()
-        db_postfix = getattr(self.config, 'slaveinput', {}).get("slaveid", "")
-        monkey_patch_creation_for_db_reuse(
-            db_postfix if not is_sqlite else None,
-            force=self.config.option.create_db
-        )
+        self.snapshot = database_snapshot(self.config.option.restore_db)
+        self.databases_ready = False
+        # alias -> seconds its database took to set up in parallel
+        self.db_setup_timings = {}
+
+    def ensure_databases(self):
+        """Set up test databases, once, right before the first test using them"""
+        if self.databases_ready:
+            return
+        self.databases_ready = True
+        self.claim_pool_slot()
+        schema_cache = None
+        if self.config.option.schema_cache and getattr(self.config, 'cache', None) is not None:
+            schema_cache = self.config.cache.mkdir('pydjango-schema')
         migrate_db = self.config.option.migrate or self.config.option.create_db
-        can_migrate = 'south' in settings.INSTALLED_APPS
+        can_migrate = 'south' in settings.INSTALLED_APPS and not self.config.option.nomigrations
         if can_migrate:
             from south.management.commands import patch_for_test_db_setup
             patch_for_test_db_setup()
+        # cursors opened meanwhile must not start savepoints
+        opening, self.savepoints.opening = self.savepoints.opening, True
+        start = time.perf_counter()
         try:
-            self.runner.setup_databases()
+            # xdist workers clone the database built by the controller
+            worker_id = db_postfix = get_worker_id(self.config)
+            template_postfix = ''
+            if self.pool_slot is not None:
+                template_postfix = pool_postfix(self.pool_slot)
+                db_postfix = pool_postfix(self.pool_slot, worker_id)
+            monkey_patch_creation_for_db_reuse(
+                db_postfix,
+                force=self.config.option.create_db,
+                template=bool(worker_id),
+                schema_cache=schema_cache,
+                template_postfix=template_postfix
+            )
+            if self.config.option.parallel_db_setup:
+                self.db_setup_timings = parallel_setup_databases(
+                    self.runner.verbosity, self.runner.interactive, self.runner.keepdb)
+            else:
+                self.runner.setup_databases()
             if migrate_db and can_migrate:
                 management.call_command('migrate', verbosity=self.config.option.verbose)
+            self.durations.db_setup = time.perf_counter() - start
+            if self.config.option.verify_schema:
+                self.check_schema()
+            if not self.is_controller:
+                self.snapshot.take()
+        except pytest.exit.Exception:
+            raise
         except Exception:
-            raise pytest.UsageError(sys.exc_info()[1])
+            if self.config.option.verify_schema:
+                # models out of sync with migrations break the setup itself
+                self.check_schema()
+            pytest.exit('Failed to set up test databases: %s' % sys.exc_info()[1],
+                        returncode=pytest.ExitCode.USAGE_ERROR)
+        finally:
+            self.savepoints.opening = opening
+        if self.is_controller:
+            # the template database must not be in use while workers clone it
+            for db in connections:
+                connections[db].close()
+
+    def check_schema(self):
+        """Exit when migrations don't produce the schema models describe"""
+        problems = verify_schema()
+        if problems:
+            lines = ['Migrated test databases differ from models:']
+            for alias, found in sorted(problems.items()):
+                lines.extend('  %s: %s' % (alias, problem) for problem in found)
+            pytest.exit('\n'.join(lines), returncode=pytest.ExitCode.TESTS_FAILED)
 
     @pytest.hookimpl(tryfirst=True)
     def pytest_sessionstart(self, session):
-        for db in connections:
-            conn = connections[db]
-            conn.set_autocommit(
-                False, force_begin_transaction_with_broken_autocommit=True
-            )
-            conn.in_atomic_block = True
-            self.original_connection_close[db] = conn.close
-            conn.close = nop
+        if self.is_controller:
+            # workers clone the databases, have them ready before they start.
+            # Workers set up databases which can't be cloned on their own
+            # but still use the pool slot given to them
+            self.claim_pool_slot()
+            if any(can_clone_test_db(connections[alias]) for alias in connections):
+                self.ensure_databases()
+            return
+        self.savepoints.install()
+        if self.queries is not None:
+            self.queries.install()
 
     def pytest_sessionfinish(self, session):
         self.runner.teardown_test_environment()
-        for db in connections:
-            connections[db].in_atomic_block = False
-            transaction.rollback(using=db)
+        if not self.is_worker:
+            self.durations.save()
+        if self.is_controller:
+            return
+        self.savepoints.uninstall()
+        self.savepoints.allowed = None
+        if self.queries is not None:
+            self.queries.uninstall()
+            self.queries.write_report(self.queries_report_path())
+        if self.query_baseline is not None:
+            self.query_baseline.save()
+        for db in self.savepoints.started:
+            end_session_transaction(connections[db])
             connections[db].in_atomic_block = True
-            if self.original_connection_close:
-                connections[db].close = self.original_connection_close[db]
-
-    def restore_database(self, item, nextitem):
-        for db in connections:
-            management.call_command('flush', verbosity=0, interactive=False,
-                                    database=db)
-        all(i.setup() for i in item.listchain())
-
-    def pytest_runtest_protocol(self, item, nextitem):
-        """Clear database if previous test item was from different module and it
-        was TransactionTestCase. then run setup on all ascending modules
+            connections[db].close = self.original_connection_close[db]
+
+    def begin_transaction(self, db):
+        """Start the session transaction on the first use of an alias"""
+        # databases used by tests not known to need them
+        self.ensure_databases()
+        conn = connections[db]
+        begin_session_transaction(conn)
+        self.original_connection_close[db] = conn.close
+        conn.close = nop
+
+    def queries_report_path(self):
+        path = self.config.option.queries_report
+        worker_id = get_worker_id(self.config)
+        if worker_id:
+            # every xdist worker writes its own report
+            root, ext = os.path.splitext(path)
+            path = '%s.%s%s' % (root, worker_id, ext)
+        return path
+
+    def pytest_runtest_logreport(self, report):
+        # xdist workers' reports are recorded by the controller
+        if not self.is_worker:
+            self.durations.record(report)
+            for name, value in report.user_properties:
+                if name == RECOVERIES_PROPERTY:
+                    self.recoveries.extend(value)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_make_scheduler(self, config, log):
+        if not config.option.balance_durations:
+            return None
+        from .scheduler import DurationScheduling
+        return DurationScheduling(config, log, durations=self.durations.load())
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.pool_slot is not None and not self.is_worker:
+            terminalreporter.write_line('pydjango: used database pool slot %d' % self.pool_slot)
+        if self.db_setup_timings:
+            terminalreporter.write_sep('=', 'pydjango database setup')
+            for alias, duration in sorted(self.db_setup_timings.items()):
+                terminalreporter.write_line('%8.3fs  %s' % (duration, alias))
+        if self.recoveries:
+            terminalreporter.write_sep('=', 'pydjango savepoint recovery')
+            terminalreporter.write_line(
+                '%d savepoints were gone or unusable, enclosing scopes were rolled back and set up again:'
+                % len(self.recoveries))
+            for nodeid, alias, target in self.recoveries:
+                terminalreporter.write_line('  %s [%s]: rolled back to %s' % (nodeid, alias, target))
+        if self.queries is not None and self.queries.tests:
+            self.queries.summary(terminalreporter)
+
+    def restore_database(self):
+        """Clean up tables written by transaction tests"""
+        dirty_tables = dict(
+            (db, tables) for db, tables in self.dirty_tables.pop().items() if tables)
+        if dirty_tables:
+            self.snapshot.restore(dirty_tables)
+
+    def is_transaction_item(self, item):
+        cls = getattr(item, 'cls', None)
+        if cls is not None and is_transaction_test(cls):
+            return True
+        return item.get_closest_marker('transaction') is not None
+
+    def needs_database(self, item):
+        cls = getattr(item, 'cls', None)
+        if cls is not None and issubclass(cls, TransactionTestCase):
+            return True
+        if any(item.get_closest_marker(name) is not None for name in DATABASE_MARKERS):
+            return True
+        return any(name in DATABASE_FIXTURES for name in getattr(item, 'fixturenames', ()))
+
+    def needs_restore(self, item, nextitem):
+        """Database should be restored if the test item was TransactionTestCase
+        and the next one is a savepoint isolated test from a different module
+        """
+        if not self.is_transaction_item(item) or nextitem is None:
+            return False
+        return nextitem.module != item.module and not self.is_transaction_item(nextitem)
+
+    def pytest_collection_modifyitems(self, session, config, items):
+        """Run savepoint isolated tests first and transaction tests after them,
+        so the database gets restored as rarely as possible. Modules and
+        classes are moved as a whole, a module with transaction tests goes
+        after all of the others and a class with them after the rest of its
+        module, so their setup runs once. The original order is kept otherwise.
         """
-        if item.cls is not None and is_transaction_test(item.cls):
-            if nextitem is None or nextitem.module != item.module:
-                if nextitem is not None:
-                    item._request.addfinalizer(lambda: self.restore_database(item, nextitem))
+        items[:] = sorted(items, key=self.transaction_order(items))
+        self.register_app_fixtures(items)
+
+    def transaction_order(self, items):
+        """Sort key moving modules, classes and tests with transaction
+        tests after the others
+        """
+        first, transactional = {}, set()
+        for index, item in enumerate(items):
+            scopes = (item.getparent(pytest.Module) or item.parent,
+                      item.getparent(pytest.Class) or item)
+            for scope in scopes:
+                first.setdefault(scope, index)
+                if self.is_transaction_item(item):
+                    transactional.add(scope)
+
+        def key(item):
+            module = item.getparent(pytest.Module) or item.parent
+            cls = item.getparent(pytest.Class) or item
+            return (module in transactional, first[module],
+                    cls in transactional, first[cls],
+                    self.is_transaction_item(item))
+        return key
+
+    def register_app_fixtures(self, items):
+        """Define app and model fixtures requested by ``items`` and not
+        defined anywhere else. Pytest looks them up again during setup.
+        """
+        missing = set()
+        for item in items:
+            info = getattr(item, '_fixtureinfo', None)
+            if info is not None:
+                missing.update(name for name in info.names_closure
+                               if name not in info.name2fixturedefs)
+        plugin = self.django_apps.plugin(missing)
+        if plugin is not None:
+            self.config.pluginmanager.register(plugin, '_pydjango_apps')
+
+    def declared_databases(self, item):
+        """Aliases declared with ``django_db(databases=[...])``, None for all"""
+        marker = item.get_closest_marker('django_db')
+        databases = marker.kwargs.get('databases') if marker is not None else None
+        if databases is None or databases == '__all__':
+            return None
+        return set(databases)
 
     def schedule_savepoints(self, item):
-        for db in connections:
-            if not hasattr(item, 'pydjango_savepoints'):
-                item.pydjango_savepoints = {}
-            item.pydjango_savepoints[db] = transaction.savepoint(using=db)
-
-    def rollback_savepoints(self, item):
-        for db in connections:
-            sid = item.pydjango_savepoints.pop(db)
-            try:
-                transaction.savepoint_rollback(sid, using=db)
-            except InternalError:
-                print(f'Failed to rollback savepoint - {sid}')
-                transaction.rollback(using=db)
+        """Schedule a savepoint layer for every module and class the item
+        belongs to and for the item itself.
+        """
+        self.savepoints.allowed = self.declared_databases(item)
+        for node in item.listchain():
+            if isinstance(node, (pytest.Module, pytest.Class)) or node is item:
+                if node not in self.savepoints.layers:
+                    self.savepoints.push(node)
+
+    def rollback_savepoints(self, item, nextitem):
+        """Rollback the item layer and every scope ``nextitem`` leaves"""
+        chain = nextitem.listchain() if nextitem is not None else []
+        for node in reversed(self.savepoints.layers):
+            if node is item or node not in chain:
+                self.savepoints.pop(node)
+                self.loaded_fixtures.pop(node, None)
+        self.savepoints.allowed = None
+
+    def leave_testcase_item(self, item):
+        """Rollback the item layer of a Django TestCase test before the item
+        is torn down.
+
+        Its savepoints are created inside the atomic block of the class,
+        which ``tearDownClass`` rolls back during the teardown.
+        """
+        cls = getattr(item, 'cls', None)
+        if cls is not None and issubclass(cls, TestCase) and item in self.savepoints.layers:
+            self.savepoints.pop(item)
+            self.loaded_fixtures.pop(item, None)
+
+    def load_data_fixtures(self, item):
+        """Load files of ``django_fixtures`` markers into the savepoint
+        layer of their scope, unless they are there already.
+
+        When an inner layer already holds a savepoint on the alias, the rows
+        land in that one and are recorded for it, so they are loaded again
+        once it is rolled back.
+        """
+        # outer scopes first, inner ones may refer to their rows
+        for marker in reversed(list(item.iter_markers('django_fixtures'))):
+            scope = marker.kwargs.get('scope', 'function')
+            using = marker.kwargs.get('using', DEFAULT_DB_ALIAS)
+            if scope not in FIXTURE_SCOPES:
+                pytest.fail('django_fixtures scope must be one of %s, not %r' % (
+                    ', '.join(FIXTURE_SCOPES), scope), pytrace=False)
+            node = item
+            if scope == 'class':
+                node = item.getparent(pytest.Class) or item.getparent(pytest.Module)
+            elif scope == 'module':
+                node = item.getparent(pytest.Module)
+            # rows of any active layer are there for the whole item
+            loaded = set()
+            for layer in self.savepoints.layers:
+                loaded.update(self.loaded_fixtures.get(layer, ()))
+            paths = []
+            for label in marker.args:
+                path = self.data_fixtures.find(label)
+                if (path, using) not in loaded and path not in paths:
+                    paths.append(path)
+            if not paths:
+                continue
+            with self.savepoints.scope(node):
+                self.data_fixtures.load(paths, using)
+            holder = self.savepoints.holder(using) or node
+            self.loaded_fixtures.setdefault(holder, set()).update((path, using) for path in paths)
+            self.savepoints.add_setup(using, node, partial(self.loaded_fixtures.pop, holder, None))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        # module and class fixtures (setup_module/setup_class included)
+        # write into the layer of their own scope, or an inner one already
+        # holding a savepoint. They run again once their data is rolled back
+        with self.savepoints.scope(request.node) as touched:
+            yield
+        if fixturedef.scope != 'function':
+            finish = partial(fixturedef.finish, request=request)
+            for alias in touched:
+                self.savepoints.add_setup(alias, request.node, finish)
 
     @pytest.hookimpl(tryfirst=True)
     def pytest_runtest_setup(self, item):
         mail.outbox = []
+        self.savepoints.reset_timings()
         if 'transaction' in item.keywords and self.skip_trans:
             pytest.skip('excluding transaction test')
+        if self.needs_database(item):
+            self.ensure_databases()
         self.schedule_savepoints(item)
+        if self.is_transaction_item(item):
+            self.dirty_tables.install()
+        self.load_data_fixtures(item)
+        if self.queries is not None:
+            self.queries.start(item)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        """Count queries of the test call against ``max_queries`` markers
+        and the query baseline.
+        """
+        budgets = [(QueryCounter(marker.kwargs.get('using', DEFAULT_DB_ALIAS)), marker.args[0])
+                   for marker in item.iter_markers('max_queries')]
+        total = QueryCounter()
+        counters = [counter for counter, budget in budgets]
+        if self.query_baseline is not None:
+            counters.append(total)
+        for counter in counters:
+            counter.install()
+        try:
+            outcome = yield
+        finally:
+            for counter in counters:
+                counter.uninstall()
+        if outcome.excinfo is not None:
+            return
+        errors = [counter.exceeded(budget) for counter, budget in budgets]
+        if self.query_baseline is not None:
+            errors.append(self.query_baseline.check(item.nodeid, total))
+        errors = [error for error in errors if error]
+        if errors:
+            failure = pytest.fail.Exception('\n\n'.join(errors), pytrace=False)
+            if hasattr(outcome, 'force_exception'):
+                outcome.force_exception(failure)
+            else:
+                raise failure
 
-    @pytest.hookimpl(trylast=True)
+    @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_teardown(self, item, nextitem):
-        if hasattr(item, 'pydjango_savepoints'):
-            self.rollback_savepoints(item)
+        self.leave_testcase_item(item)
+        yield
+        self.rollback_savepoints(item, nextitem)
+        self.dirty_tables.uninstall()
+        if self.queries is not None:
+            self.queries.stop()
+        start = time.perf_counter()
+        if self.needs_restore(item, nextitem):
+            self.restore_database()
+        timings = self.savepoints.reset_timings()
+        timings['restore'] = time.perf_counter() - start
+        timings['transaction'] = self.is_transaction_item(item)
+        item.user_properties.append((USER_PROPERTY, timings))
+        recoveries = self.savepoints.pop_recoveries()
+        if recoveries:
+            item.user_properties.append((RECOVERIES_PROPERTY, recoveries))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Test durations kept in the pytest cache across runs.
+
+Besides the wall time of a test its savepoint, rollback and database
+restore time are kept, as well as whether it is a transaction test. The
+time the session spent setting up databases is kept separately.
+"""
+
+CACHE_KEY = 'pydjango/durations'
+SETUP_CACHE_KEY = 'pydjango/db_setup'
+USER_PROPERTY = 'pydjango'
+
+
+class Durations(object):
+
+    def __init__(self, config):
+        self.config = config
+        self.observed = {}
+        self.db_setup = None
+
+    @property
+    def cache(self):
+        # the cache provider is configured after pydjango
+        return getattr(self.config, 'cache', None)
+
+    def load(self):
+        if self.cache is None:
+            return {}
+        return self.cache.get(CACHE_KEY, {})
+
+    def record(self, report):
+        """Add a phase report of a test"""
+        entry = self.observed.setdefault(report.nodeid, {'duration': 0.0})
+        entry['duration'] += report.duration
+        for name, value in report.user_properties:
+            if name == USER_PROPERTY:
+                entry.update(value)
+
+    def save(self):
+        if self.cache is None:
+            return
+        if self.observed:
+            durations = self.load()
+            durations.update(self.observed)
+            self.cache.set(CACHE_KEY, durations)
+        if self.db_setup is not None:
+            self.cache.set(SETUP_CACHE_KEY, self.db_setup)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Fingerprints of the test database schema.
+
+A fingerprint covers the migration graph on disk and the schema current
+models expect. It is stored inside the test database, so a database left
+from a previous run can be told apart from a stale one.
+"""
+
+import hashlib
+
+from django.apps import apps
+from django.db.migrations.loader import MigrationLoader
+
+
+FINGERPRINT_TABLE = 'pydjango_fingerprint'
+
+REUSE = 'reuse'
+MIGRATE = 'migrate'
+REBUILD = 'rebuild'
+
+
+def migration_state(connection):
+    """Return migrations on disk and the ones applied to the database"""
+    loader = MigrationLoader(connection)
+    replaced = set()
+    for migration in loader.replacements.values():
+        replaced.update(migration.replaces)
+    applied = set(loader.applied_migrations) - replaced
+    return set(loader.graph.nodes), applied
+
+
+def schema_fingerprint(connection, graph):
+    """Hash the migration graph and the tables, columns, indexes and
+    constraints of all models
+    """
+    fingerprint = hashlib.sha1()
+    for node in sorted(graph):
+        fingerprint.update(repr(node).encode('utf-8'))
+    models = apps.get_models(include_auto_created=True)
+    for model in sorted(models, key=lambda m: m._meta.db_table):
+        fingerprint.update(model._meta.db_table.encode('utf-8'))
+        for field in model._meta.local_fields:
+            column = (field.column, field.db_type(connection), field.null, field.unique)
+            fingerprint.update(repr(column).encode('utf-8'))
+        options = (
+            sorted(tuple(fields) for fields in model._meta.unique_together),
+            sorted(repr(index.deconstruct()) for index in model._meta.indexes),
+            sorted(repr(constraint.deconstruct()) for constraint in model._meta.constraints),
+        )
+        fingerprint.update(repr(options).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def schema_cache_key(connection, fingerprint):
+    """Key of the cached schema of an alias, routers may give every alias
+    different tables
+    """
+    return hashlib.sha1(('%s:%s' % (connection.alias, fingerprint)).encode('utf-8')).hexdigest()
+
+
+def current_fingerprint(connection):
+    return schema_fingerprint(connection, migration_state(connection)[0])
+
+
+def fresh_fingerprint(connection):
+    """Fingerprint of a database built from scratch, without querying it"""
+    graph = MigrationLoader(None, ignore_no_migrations=True).graph
+    return schema_fingerprint(connection, set(graph.nodes))
+
+
+def read_fingerprint(connection):
+    if FINGERPRINT_TABLE not in connection.introspection.table_names():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT fingerprint FROM %s' % connection.ops.quote_name(FINGERPRINT_TABLE))
+        row = cursor.fetchone()
+    return row and row[0]
+
+
+def write_fingerprint(connection, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = current_fingerprint(connection)
+    table = connection.ops.quote_name(FINGERPRINT_TABLE)
+    exists = FINGERPRINT_TABLE in connection.introspection.table_names()
+    with connection.cursor() as cursor:
+        if not exists:
+            cursor.execute('CREATE TABLE %s (fingerprint varchar(40) NOT NULL)' % table)
+        cursor.execute('DELETE FROM %s' % table)
+        cursor.execute('INSERT INTO %s (fingerprint) VALUES (%%s)' % table, [fingerprint])
+
+
+def reuse_strategy(connection):
+    """Decide what to do with a test database left from a previous run.
+
+    Databases with a matching fingerprint are reused as is. When the
+    applied migrations are a strict subset of the migration graph only the
+    missing ones get applied. Anything else has diverged and is rebuilt,
+    databases created without migrations or without a fingerprint included.
+    """
+    stored = read_fingerprint(connection)
+    if stored is None:
+        # nothing tells whether the schema of an older database is stale
+        return REBUILD
+    graph, applied = migration_state(connection)
+    if applied and applied < graph:
+        return MIGRATE
+    if applied != graph:
+        return REBUILD
+    return REUSE if stored == schema_fingerprint(connection, graph) else REBUILD
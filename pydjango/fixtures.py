@@ -13,6 +13,7 @@ from django.db import models
 from django.test.client import Client, RequestFactory
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import login
+from django.contrib.auth.hashers import make_password
 try:
     from django.contrib.auth import get_user_model
 except ImportError:
@@ -26,6 +27,22 @@ except ImportError:
     selenium_available = False
 
 from .live_server_helper import LiveServer
+from .queries import query_budget
+from .sessions import AUTH_BACKEND
+from .utils import get_worker_index
+
+
+# port 0 lets the OS pick a free port
+DEFAULT_LIVE_SERVER_ADDRESS = 'localhost:0'
+
+# raw password -> hash, computed once per session
+password_hashes = {}
+
+
+def hashed_password(password):
+    if password not in password_hashes:
+        password_hashes[password] = make_password(password)
+    return password_hashes[password]
 
 
 def webdriver_get(self, url, prefix=''):
@@ -48,21 +65,39 @@ def django_model(model):
     return wrapper
 
 
-class DjangoAppsMeta(type):
-    def __new__(cls, clsname, bases, dct):
-        klass = type.__new__(cls, clsname, bases, dct)
-        for app_name in set(settings.INSTALLED_APPS):
-            name = app_name.split('.')[-1]
-            setattr(klass, name, pytest.fixture(scope='session')(django_app(app_name)))
-        for model in apps.get_models():
-            name = model._meta.object_name
-            setattr(klass, name, pytest.fixture(scope='session')(django_model(model)))
-        return klass
+class DjangoApps(object):
+    """Fixtures of installed apps and models.
 
-DjangoApps = DjangoAppsMeta('DjangoApps', (object, ), {})
+    Only fixtures of names requested by collected tests are made, instead
+    of one for every app and model of the project.
+    """
 
+    def __init__(self):
+        self._factories = None
 
-class Fixtures(DjangoApps):
+    @property
+    def factories(self):
+        """fixture name -> function returning the app or model"""
+        if self._factories is None:
+            factories = {}
+            for app_name in set(settings.INSTALLED_APPS):
+                factories[app_name.split('.')[-1]] = django_app(app_name)
+            for model in apps.get_models():
+                factories[model._meta.object_name] = django_model(model)
+            self._factories = factories
+        return self._factories
+
+    def plugin(self, names):
+        """Return a plugin defining fixtures for known ``names`` or None"""
+        fixtures = dict(
+            (name, pytest.fixture(scope='session', name=name)(self.factories[name]))
+            for name in names if name in self.factories)
+        if not fixtures:
+            return None
+        return type('DjangoApps', (object, ), fixtures)()
+
+
+class Fixtures(object):
 
     @pytest.fixture()
     def client(self):
@@ -88,10 +123,11 @@ class Fixtures(DjangoApps):
         try:
             user = cls.objects.get(username='test')
         except cls.DoesNotExist:
-            user = cls.objects.create_user(
-                username='test',
-                email='test@example.com',
-                password='test')
+            # create_user would hash the password again, or need an UPDATE
+            # to store the hash cached for the session
+            user = cls(username='test', email=cls.objects.normalize_email('test@example.com'),
+                       password=hashed_password('test'))
+            user.save()
         return user
 
     @pytest.fixture()
@@ -100,34 +136,42 @@ class Fixtures(DjangoApps):
         try:
             admin = cls.objects.get(username='admin')
         except cls.DoesNotExist:
-            admin = cls.objects.create_superuser(
-                username='admin',
-                email='admin@example.com',
-                password='admin')
+            admin = cls(username='admin', email=cls.objects.normalize_email('admin@example.com'),
+                        password=hashed_password('admin'), is_staff=True, is_superuser=True)
+            admin.save()
         return admin
 
+    @pytest.fixture()
+    def query_budget(self):
+        """Context manager failing the test when the block executes more
+        than ``n`` queries: ``with query_budget(n, using='default'):``
+        """
+        return query_budget
+
     @pytest.fixture(scope='session')
     def settings(self):
         return settings
 
-    @pytest.fixture()
-    def uclient(self, client, test_user, rf):
-        """Client instance with logged in user
-        """
-        test_user.backend = 'django.contrib.auth.backends.ModelBackend'
-        if client.session:
-            rf.session = client.session
+    def login_client(self, client, user, rf):
+        """Attach the session of logged in ``user`` to ``client``"""
+        user.backend = AUTH_BACKEND
+        if self.session_seeder.supports():
+            session_key = self.session_seeder.session_key(user)
         else:
-            engine = import_module(settings.SESSION_ENGINE)
-            rf.session = engine.SessionStore()
-        login(rf, test_user)
+            if client.session:
+                rf.session = client.session
+            else:
+                engine = import_module(settings.SESSION_ENGINE)
+                rf.session = engine.SessionStore()
+            login(rf, user)
 
-        # Save the session values.
-        rf.session.save()
+            # Save the session values.
+            rf.session.save()
+            session_key = rf.session.session_key
 
         # Set the cookie to represent the session.
         session_cookie = settings.SESSION_COOKIE_NAME
-        client.cookies[session_cookie] = rf.session.session_key
+        client.cookies[session_cookie] = session_key
         cookie_data = {
             'max-age': None,
             'path': '/',
@@ -136,19 +180,26 @@ class Fixtures(DjangoApps):
             'expires': None,
         }
         client.cookies[session_cookie].update(cookie_data)
-        client.user = test_user
+        client.user = user
         return client
 
+    @pytest.fixture()
+    def uclient(self, client, test_user, rf):
+        """Client instance with logged in user
+        """
+        return self.login_client(client, test_user, rf)
+
     @pytest.fixture()
     def aclient(self, client, admin_user, rf):
         """Client instance with logged in admin
         """
-        return self.uclient(client, admin_user, rf)
+        return self.login_client(client, admin_user, rf)
 
     @pytest.fixture(scope='session')
     def live_server(self, request):
+        worker, workers = get_worker_index(self.config)
         server = LiveServer(self.live_server_class, os.environ.get(
-            'DJANGO_LIVE_TEST_SERVER_ADDRESS', 'localhost:8081-8089'))
+            'DJANGO_LIVE_TEST_SERVER_ADDRESS', DEFAULT_LIVE_SERVER_ADDRESS), worker, workers)
         request.addfinalizer(server.stop)
         return server
 
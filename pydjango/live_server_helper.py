@@ -3,11 +3,17 @@
 import threading
 import errno
 import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from django.contrib.staticfiles.handlers import StaticFilesHandler
+from django.core.servers.basehttp import WSGIServer, ThreadedWSGIServer
+from django.db import connections
 from django.test.testcases import _MediaFilesHandler, QuietWSGIRequestHandler
 from django.core.handlers.wsgi import WSGIHandler
 
+from .db_reuse import CONNECTION_LOCK
+
 
 def supported():
     import django.test.testcases
@@ -15,12 +21,127 @@ def supported():
     return hasattr(django.test.testcases, 'LiveServerThread')
 
 
+class KeepAliveRequestHandler(QuietWSGIRequestHandler):
+    """Serves HTTP/1.1 keep-alive connections"""
+
+    protocol_version = 'HTTP/1.1'
+    # idle connections give their pool thread back after that many seconds
+    timeout = 5
+
+
+class RequestStats(object):
+    """Latencies of requests served by the live server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = []
+
+    def add(self, duration):
+        with self.lock:
+            self.durations.append(duration)
+
+    def summary(self):
+        durations = sorted(self.durations)
+        if not durations:
+            return {'count': 0}
+        count = len(durations)
+        return {
+            'count': count,
+            'mean': sum(durations) / count,
+            'p50': durations[count // 2],
+            'p95': durations[min(count - 1, int(count * 0.95))],
+            'max': durations[-1],
+        }
+
+
+class ConnectionLock(object):
+    """Execute wrapper serializing database access while a live server runs.
+
+    Request threads share the database connections of the tests (see
+    ``wrap_database``). A request takes the lock with its first query and
+    holds it until it is served, so transactions and savepoints of
+    concurrent requests don't interleave. Requests which don't touch the
+    database, like static files, never wait for it. Other threads, the
+    test itself included, take the lock for every query.
+    """
+
+    def __init__(self):
+        self.lock = CONNECTION_LOCK
+        self.local = threading.local()
+
+    def __call__(self, execute, sql, params, many, context):
+        local = self.local
+        if not getattr(local, 'serving', False):
+            with self.lock:
+                return execute(sql, params, many, context)
+        if not getattr(local, 'locked', False):
+            self.lock.acquire()
+            local.locked = True
+        return execute(sql, params, many, context)
+
+    def install(self):
+        for alias in connections:
+            connections[alias].execute_wrappers.append(self)
+
+    def uninstall(self):
+        for alias in connections:
+            wrappers = connections[alias].execute_wrappers
+            if self in wrappers:
+                wrappers.remove(self)
+
+    def start_request(self):
+        self.local.serving = True
+
+    def finish_request(self):
+        self.local.serving = False
+        if getattr(self.local, 'locked', False):
+            self.local.locked = False
+            self.lock.release()
+
+
+class ThreadPoolWSGIServer(ThreadedWSGIServer):
+    """WSGI server handling requests on a pool of ``threads`` threads"""
+
+    threads = 16
+    request_handler = KeepAliveRequestHandler
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadPoolWSGIServer, self).__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.stats = RequestStats()
+        self.db_lock = ConnectionLock()
+        self.db_lock.install()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def close_request(self, request):
+        # connections are shared with the tests, leave them open
+        WSGIServer.close_request(self, request)
+
+    def set_app(self, application):
+        def timed(environ, start_response):
+            self.db_lock.start_request()
+            start = time.perf_counter()
+            try:
+                return application(environ, start_response)
+            finally:
+                self.db_lock.finish_request()
+                self.stats.add(time.perf_counter() - start)
+        super(ThreadPoolWSGIServer, self).set_app(timed)
+
+    def server_close(self):
+        super(ThreadPoolWSGIServer, self).server_close()
+        self.executor.shutdown(wait=False)
+        self.db_lock.uninstall()
+
+
 class LiveServerThread(threading.Thread):
     """
     Thread for running a live http server while the tests are running.
     """
 
-    def __init__(self, server_class, addr):
+    def __init__(self, server_class, addr, worker=0, workers=1):
         self.is_ready = threading.Event()
         self.server_class = server_class
         self.error = None
@@ -40,6 +161,9 @@ class LiveServerThread(threading.Thread):
                         self.possible_ports.append(port)
         except Exception:
             raise Exception('Invalid address ("%s") for live server.' % addr)
+        # xdist workers get their own share of the ports, port 0 lets the
+        # OS pick a free one when there are not enough of them
+        self.possible_ports = self.possible_ports[worker::workers] or [0]
         super(LiveServerThread, self).__init__()
 
     def start_http_server(self, port, handler):
@@ -71,14 +195,20 @@ class LiveServerThread(threading.Thread):
                 if hasattr(self.server_class, 'set_app'):
                     # should set handlers specified above a bit later as
                     # this one takes QuietWSGIRequestHandler
-                    self.httpd = self.start_http_server(port, QuietWSGIRequestHandler)
+                    request_handler = getattr(
+                        self.server_class, 'request_handler', QuietWSGIRequestHandler)
+                    self.httpd = self.start_http_server(port, request_handler)
                 else:
                     self.httpd = self.start_http_server(port, handler)
                 if self.httpd is None:
                     continue
-                # A free port was found.
-                self.port = port
+                # A free port was found, ask the server for the one bound to
+                # as it is picked by the OS for port 0.
+                self.port = getattr(self.httpd, 'server_address', (self.host, port))[1]
                 break
+            else:
+                raise socket.error(errno.EADDRINUSE, 'No free port for live server in %s' % (
+                    ', '.join(map(str, self.possible_ports))))
             if hasattr(self.httpd, 'set_app'):
                 self.httpd.set_app(handler)
             self.is_ready.set()
@@ -107,8 +237,8 @@ class LiveServer(object):
     """
     server_thread = LiveServerThread
 
-    def __init__(self, server_class, addr):
-        self.thread = self.server_thread(server_class, addr)
+    def __init__(self, server_class, addr, worker=0, workers=1):
+        self.thread = self.server_thread(server_class, addr, worker, workers)
         self.thread.daemon = True
         self.thread.start()
         self.thread.is_ready.wait()
@@ -119,6 +249,12 @@ class LiveServer(object):
         """Stop the server"""
         self.thread.join(1)
 
+    @property
+    def stats(self):
+        """Request latencies in seconds, for servers recording them"""
+        stats = getattr(self.thread.httpd, 'stats', None)
+        return stats and stats.summary()
+
     @property
     def url(self):
         return 'http://%s:%s' % (self.thread.host, self.thread.port)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Parallel setup of test databases.
+
+Test databases are set up in waves: a database is created once those it
+depends on (``TEST['DEPENDENCIES']``, the default alias unless set) are
+ready and every database of a wave is created on its own thread. Mirrors
+are set up afterwards, just like Django does it.
+
+Threads share the connections set up by ``wrap_database``, every alias is
+only used by the thread creating its database. Django doesn't make
+``migrate``, ``post_migrate`` handlers or the content type cache thread-safe,
+so management commands of the threads run one at a time. Creating, cloning,
+copying and reusing databases overlaps.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core import management
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import get_unique_databases_and_mirrors
+
+
+COMMAND_LOCK = threading.Lock()
+
+
+def dependencies(aliases):
+    """Aliases the database used by ``aliases`` depends on"""
+    depends = set()
+    for alias in aliases:
+        test_settings = connections[alias].settings_dict.get('TEST', {})
+        if alias != DEFAULT_DB_ALIAS:
+            depends.update(test_settings.get('DEPENDENCIES', [DEFAULT_DB_ALIAS]))
+    return depends - set(aliases)
+
+
+def setup_waves(test_databases):
+    """Split ``(db_name, aliases)`` pairs into lists of independent ones"""
+    pending = list(test_databases)
+    known = set(alias for db_name, aliases in pending for alias in aliases)
+    ready = set()
+    waves = []
+    while pending:
+        wave = [(db_name, aliases) for db_name, aliases in pending
+                if dependencies(aliases) & known <= ready]
+        if not wave:
+            raise ImproperlyConfigured('Circular dependency in TEST[DEPENDENCIES]')
+        for db_name, aliases in wave:
+            pending.remove((db_name, aliases))
+            ready.update(aliases)
+        waves.append(wave)
+    return waves
+
+
+@contextmanager
+def serialized_commands():
+    """Run management commands called by any thread one at a time"""
+    # database creation imports call_command when it runs migrate
+    original = management.call_command
+
+    def call_command(*args, **kwargs):
+        with COMMAND_LOCK:
+            return original(*args, **kwargs)
+    management.call_command = call_command
+    try:
+        yield
+    finally:
+        management.call_command = original
+
+
+def create_test_db(alias, verbosity, interactive, keepdb):
+    start = time.perf_counter()
+    connections[alias].creation.create_test_db(
+        verbosity=verbosity,
+        autoclobber=not interactive,
+        keepdb=keepdb,
+        serialize=False,
+    )
+    return alias, time.perf_counter() - start
+
+
+def setup_databases(verbosity, interactive=False, keepdb=False, serialized_aliases=None):
+    """Create test databases of independent aliases at once.
+
+    Return how long it took to set up the database of every alias.
+    """
+    test_databases, mirrored_aliases = get_unique_databases_and_mirrors()
+    timings = {}
+    for wave in setup_waves(test_databases.values()):
+        with serialized_commands(), ThreadPoolExecutor(len(wave)) as executor:
+            futures = [executor.submit(create_test_db, aliases[0], verbosity, interactive, keepdb)
+                       for db_name, aliases in wave]
+            timings.update(future.result() for future in futures)
+        for db_name, aliases in wave:
+            for alias in aliases[1:]:
+                connections[alias].creation.set_as_test_mirror(
+                    connections[aliases[0]].settings_dict)
+
+    for alias, mirror_alias in mirrored_aliases.items():
+        connections[alias].creation.set_as_test_mirror(connections[mirror_alias].settings_dict)
+
+    # like Django does, serialize once all databases are set up
+    for db_name, aliases in test_databases.values():
+        if serialized_aliases is None or aliases[0] in serialized_aliases:
+            connection = connections[aliases[0]]
+            connection._test_serialized_contents = connection.creation.serialize_db_to_string()
+    return timings
@@ -17,7 +17,8 @@ except ImportError:
     ENVIRONMENT_VARIABLE = "DJANGO_SETTINGS_MODULE"
 
 
-DEFAULT_LIVE_SERVER = 'django.test.testcases.StoppableWSGIServer'
+DEFAULT_LIVE_SERVER = 'django.core.servers.basehttp.ThreadedWSGIServer'
+DEFAULT_POOL_SIZE = 8
 
 
 def pytest_addoption(parser):
@@ -31,9 +32,67 @@ def pytest_addoption(parser):
     group._addoption('--migrate',
                      action='store_true', dest='migrate', default=False,
                      help='sync db and run migrations')
+    group._addoption('--schema-cache',
+                     action='store_true', dest='schema_cache', default=False,
+                     help='Copy new test databases from snapshots of their schema kept in '
+                          'pytest cache (SQLite) or template databases (PostgreSQL)')
+    group._addoption('--nomigrations',
+                     action='store_true', dest='nomigrations', default=False,
+                     help='Create test databases from models, without running migrations')
+    group._addoption('--verify-schema',
+                     action='store_true', dest='verify_schema', default=False,
+                     help='Fail when migrated test databases differ from models or '
+                          'models have changes without migrations')
+    group._addoption('--db-pool',
+                     action='store', dest='db_pool', default=None, metavar='DIR',
+                     help='Claim a slot of a database pool shared by runs on this host through '
+                          'lock files in DIR and use test databases of that slot')
+    group._addoption('--db-pool-size',
+                     action='store', dest='db_pool_size', type=int, default=DEFAULT_POOL_SIZE,
+                     help='Number of slots of --db-pool. default: %d' % DEFAULT_POOL_SIZE)
+    group._addoption('--sqlite-fast',
+                     action='store_true', dest='sqlite_fast', default=False,
+                     help='Keep SQLite journals in memory and never wait for data to reach the disk')
+    group._addoption('--sqlite-dir',
+                     action='store', dest='sqlite_dir', default=None, metavar='DIR',
+                     help='Keep SQLite test database files in DIR, e.g. on tmpfs like /dev/shm')
+    group._addoption('--parallel-db-setup',
+                     action='store_true', dest='parallel_db_setup', default=False,
+                     help='Set up test databases of independent aliases at once, '
+                          'in order of their TEST["DEPENDENCIES"]')
+    group._addoption('--restore-db',
+                     action='store', dest='restore_db', default='flush',
+                     choices=('flush', 'snapshot'),
+                     help='How to restore the database after transaction tests. '
+                          '"snapshot" restores a copy taken after database setup. default: flush')
+    group._addoption('--pydjango-queries',
+                     action='store_true', dest='queries', default=False,
+                     help='Record SQL queries of every test and report the worst ones')
+    group._addoption('--pydjango-queries-report',
+                     action='store', dest='queries_report', default='pydjango-queries.json',
+                     help='Where to write the JSON report of --pydjango-queries. '
+                          'default: pydjango-queries.json')
+    group._addoption('--queries-baseline',
+                     action='store', dest='queries_baseline', default=None,
+                     help='JSON file with query counts of tests. Tests executing more '
+                          'queries than recorded there fail')
+    group._addoption('--queries-baseline-update',
+                     action='store_true', dest='queries_baseline_update', default=False,
+                     help='Write observed query counts to --queries-baseline file')
+    group._addoption('--balance-durations',
+                     action='store_true', dest='balance_durations', default=False,
+                     help='Distribute tests to xdist nodes by their durations in previous runs '
+                          'and run all transactional tests on a single node')
+    group._addoption('--fast-hasher',
+                     action='store_true', dest='fast_hasher', default=False,
+                     help='Hash passwords with a fast (and insecure) MD5 hasher')
     group._addoption('--liveserver-class',
                      action='store', dest='liveserver_class', default=DEFAULT_LIVE_SERVER,
                      help='Set live server class to serve requests. default: %s' % DEFAULT_LIVE_SERVER)
+    group._addoption('--liveserver-threads',
+                     action='store', dest='liveserver_threads', type=int, default=None,
+                     help='Number of threads serving live server requests, for '
+                          'pydjango.live_server_helper.ThreadPoolWSGIServer. default: 16')
     group._addoption('--skip-trans',
                      action='store_true', dest='skip_trans', default=False,
                      help='Skip transactional tests')
@@ -49,6 +108,16 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers",
         "selenium: this test is running with a selenium browser")
+    config.addinivalue_line(
+        "markers",
+        "django_db(databases=None): database aliases the test uses, others are not accessible")
+    config.addinivalue_line(
+        "markers",
+        "django_fixtures(*files, scope='function', using='default'): load data fixture files "
+        "once per function, class or module")
+    config.addinivalue_line(
+        "markers",
+        "max_queries(n, using='default'): fail if the test executes more than n queries")
     config.addinivalue_line(
         "markers",
         "slow: expected to run slow (e.g. spawning a browser underneath for selenium tests)"
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Pool of test databases shared by concurrent runs on one host.
+
+A run claims a free slot by locking its file in a shared directory and
+uses test databases named after the slot (``test_x_p3``, ``test_x_p3_gw0``
+for its xdist workers), reused by whichever run gets the slot next. Locks
+are held by the process running the session (the xdist controller) and
+are released by the OS when it exits, however it does.
+"""
+
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class DatabasePool(object):
+
+    def __init__(self, directory, size, poll=1.0):
+        self.directory = directory
+        self.size = size
+        self.poll = poll
+        self.slot = None
+        self.lock_file = None
+
+    def try_claim(self, slot):
+        lock_file = open(os.path.join(self.directory, 'slot%d.lock' % slot), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            lock_file.close()
+            return False
+        self.slot, self.lock_file = slot, lock_file
+        return True
+
+    def claim(self, wait=None):
+        """Lock the first free slot, polling while all of them are taken.
+
+        ``wait`` is called once with the pool when it has to wait.
+        """
+        if fcntl is None:
+            raise RuntimeError('a database pool needs file locks of fcntl')
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        waited = False
+        while True:
+            for slot in range(self.size):
+                if self.try_claim(slot):
+                    return slot
+            if wait is not None and not waited:
+                wait(self)
+                waited = True
+            time.sleep(self.poll)
+
+    def release(self):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+            self.slot = None
+
+
+def pool_postfix(slot, worker_id=''):
+    """Test database name postfix of ``slot`` (and xdist worker)"""
+    postfix = '_p%d' % slot
+    if worker_id:
+        postfix += '_%s' % worker_id
+    return postfix
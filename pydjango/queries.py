@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Per test SQL query instrumentation.
+
+Every connection gets an execute wrapper which records the queries of
+the running test: their number, total time, the slowest statements and
+statements of the same shape executed over and over again (N+1).
+
+Query budgets count queries the same way and fail tests exceeding them.
+"""
+
+import heapq
+import json
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import pytest
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+SLOWEST = 5
+REPEATED = 3
+WORST = 10
+
+SAVEPOINT_RE = re.compile(r'^\s*(?:SAVEPOINT|RELEASE\s+SAVEPOINT|ROLLBACK\s+TO\s+SAVEPOINT)\b',
+                          re.IGNORECASE)
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+LIST_RE = re.compile(r'\(\s*(?:(?:%s|\?)\s*,\s*)+(?:%s|\?)\s*\)')
+
+
+def is_savepoint_sql(sql):
+    """Savepoints are created by pydjango itself and aren't worth reporting"""
+    return SAVEPOINT_RE.match(sql) is not None
+
+
+def query_shape(sql):
+    """Return ``sql`` with literals and parameter lists collapsed"""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = LIST_RE.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+class QueryStats(object):
+    """Queries of a single test"""
+
+    __slots__ = ('nodeid', 'count', 'duration', 'slowest', 'shapes')
+
+    def __init__(self, nodeid):
+        self.nodeid = nodeid
+        self.count = 0
+        self.duration = 0.0
+        # heap of (duration, sql)
+        self.slowest = []
+        self.shapes = Counter()
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        if len(self.slowest) < SLOWEST:
+            heapq.heappush(self.slowest, (duration, sql))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sql))
+        self.shapes[query_shape(sql)] += 1
+
+    def compact(self):
+        """Forget shapes which were not repeated"""
+        self.shapes = Counter(dict(
+            (shape, count) for shape, count in self.shapes.items() if count >= REPEATED))
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'duration': round(self.duration, 6),
+            'slowest': [{'sql': sql, 'duration': round(duration, 6)}
+                        for duration, sql in sorted(self.slowest, reverse=True)],
+            'repeated': [{'sql': shape, 'count': count}
+                         for shape, count in self.shapes.most_common()],
+        }
+
+
+class QueryRecorder(object):
+
+    def __init__(self):
+        self.current = None
+        self.tests = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.current is None or is_savepoint_sql(sql):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.current.add(sql, time.perf_counter() - start)
+
+    def install(self):
+        for alias in connections:
+            connections[alias].execute_wrappers.append(self)
+
+    def uninstall(self):
+        for alias in connections:
+            wrappers = connections[alias].execute_wrappers
+            if self in wrappers:
+                wrappers.remove(self)
+
+    def start(self, item):
+        self.current = QueryStats(item.nodeid)
+
+    def stop(self):
+        if self.current is not None:
+            self.current.compact()
+            self.tests.append(self.current)
+            self.current = None
+
+    def worst(self, count=WORST):
+        return sorted(self.tests, key=lambda t: (t.count, t.duration), reverse=True)[:count]
+
+    def write_report(self, path):
+        report = {'tests': dict((test.nodeid, test.as_dict()) for test in self.tests)}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+    def summary(self, terminalreporter):
+        terminalreporter.write_sep('=', 'pydjango queries')
+        for test in self.worst():
+            if not test.count:
+                break
+            terminalreporter.write_line('%5d queries %8.3fs  %s' % (
+                test.count, test.duration, test.nodeid))
+            for shape, count in test.shapes.most_common(SLOWEST):
+                terminalreporter.write_line('      x%-4d %s' % (count, shape[:120]))
+
+
+class QueryCounter(object):
+    """Execute wrapper collecting queries sent to ``using`` (all aliases if None)"""
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries = []
+        self.aliases = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not is_savepoint_sql(sql):
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def install(self):
+        self.aliases = [self.using] if self.using else list(connections)
+        for alias in self.aliases:
+            connections[alias].execute_wrappers.append(self)
+
+    def uninstall(self):
+        for alias in self.aliases:
+            connections[alias].execute_wrappers.remove(self)
+        self.aliases = []
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.uninstall()
+
+    def exceeded(self, budget, what='budget'):
+        """Return why ``budget`` was exceeded or None"""
+        if len(self) <= budget:
+            return None
+        lines = ['%d queries executed on %s, %s is %d:' % (
+            len(self), self.using or 'all databases', what, budget)]
+        lines.extend('%d. %s' % (i, sql) for i, sql in enumerate(self.queries, 1))
+        return '\n'.join(lines)
+
+
+@contextmanager
+def query_budget(budget, using=DEFAULT_DB_ALIAS):
+    """Fail the test if more than ``budget`` queries are executed in the block"""
+    with QueryCounter(using) as counter:
+        yield counter
+    error = counter.exceeded(budget)
+    if error:
+        pytest.fail(error, pytrace=False)
+
+
+class QueryBaseline(object):
+    """Query counts of every test stored in a JSON file"""
+
+    def __init__(self, path, update=False):
+        self.path = path
+        self.update = update
+        self.counts = self.load()
+        self.observed = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def check(self, nodeid, counter):
+        self.observed[nodeid] = len(counter)
+        if self.update or nodeid not in self.counts:
+            return None
+        return counter.exceeded(self.counts[nodeid], 'baseline')
+
+    def save(self):
+        if not self.update:
+            return
+        # other xdist nodes write their counts into the same file
+        with self.locked():
+            counts = self.load()
+            counts.update(self.observed)
+            with open(self.path, 'w') as f:
+                json.dump(counts, f, indent=1, sort_keys=True)
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive lock on the file while reading and writing it"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
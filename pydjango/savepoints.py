@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Lazy savepoints.
+
+Every module, class and test item gets a savepoint layer while it is
+running. A layer is only scheduled though: its savepoint gets created on
+a database alias the first time a cursor is opened on that alias within
+its own scope, so scopes which never touch a database cost no round-trips
+at all, whatever their tests do. The same goes for the session wide
+transaction of every alias.
+
+Tests may declare the aliases they use, any other alias is off limits
+for them.
+
+Setups writing to the database (fixtures, ``setup_class`` and the like)
+are registered with the layer holding their data. When that layer is left
+before the scope of the setup ends, the setup is finished so pytest runs
+it again when the next test requests it.
+
+A test may leave its savepoint unusable, e.g. by rolling back further
+itself or by breaking the transaction. Leaving its layer then rolls back
+to the nearest enclosing savepoint still there, or starts the session
+transaction of the alias over when none is left. The layer rolled back to
+and every active one within it lose their data on all aliases, so their
+setups are finished and run again for the next test.
+"""
+
+import time
+from contextlib import contextmanager
+
+from django.db import connections, transaction, DatabaseError
+
+from .db_reuse import begin_session_transaction, end_session_transaction, CONNECTION_LOCK
+
+
+# atomic() checks autocommit before it opens any cursor, the session
+# transaction and outer savepoints have to exist by then
+CURSOR_METHODS = ('cursor', 'chunked_cursor', 'get_autocommit')
+
+# user property of test reports listing recoveries during the test
+RECOVERIES_PROPERTY = 'pydjango_recoveries'
+
+
+class DatabaseNotDeclared(AssertionError):
+    pass
+
+
+class LazySavepoints(object):
+
+    def __init__(self, begin):
+        # called with an alias to start its session transaction
+        self.begin = begin
+        self.started = set()
+        # active nodes, outermost first
+        self.layers = []
+        # alias -> nodes holding a savepoint on it, outermost first
+        self.stacks = {}
+        # node whose scope is being set up or run
+        self.current = None
+        # aliases the running test may use, None for all of them
+        self.allowed = None
+        self.opening = False
+        # seconds spent on savepoints of the running test
+        self.timings = {'savepoint': 0.0, 'rollback': 0.0}
+        # [node id, alias, what was rolled back to instead] of every
+        # recovery since the last call of pop_recoveries()
+        self.recoveries = []
+        # layer holding their data (None for session transactions) ->
+        # (alias, owner node, finish) of setups
+        self.setups = {}
+        # aliases touched within the innermost scope()
+        self.touched = set()
+
+    def install(self):
+        for alias in connections:
+            conn = connections[alias]
+            for name in CURSOR_METHODS:
+                setattr(conn, name, self.wrap_cursor(alias, getattr(conn, name)))
+
+    def uninstall(self):
+        for alias in connections:
+            conn = connections[alias]
+            for name in CURSOR_METHODS:
+                conn.__dict__.pop(name, None)
+
+    def wrap_cursor(self, alias, cursor):
+        def wrapper(*args, **kwargs):
+            self.touch(alias)
+            return cursor(*args, **kwargs)
+        return wrapper
+
+    def touch(self, alias):
+        """Create a savepoint on ``alias`` for the current layer"""
+        # threads of live servers share the connections and this state
+        with CONNECTION_LOCK:
+            if self.opening:
+                return
+            if self.allowed is not None and alias not in self.allowed:
+                raise DatabaseNotDeclared(
+                    "Database '%s' is not declared by %s, add it to "
+                    "@pytest.mark.django_db(databases=[...])" % (alias, self.current.nodeid))
+            if alias not in self.started:
+                self.opening = True
+                try:
+                    self.begin(alias)
+                finally:
+                    self.opening = False
+                self.started.add(alias)
+            self.touched.add(alias)
+            if self.current not in self.layers or alias in self.current.savepoints:
+                return
+            depth = self.layers.index(self.current) + 1
+            if any(alias in node.savepoints for node in self.layers[depth:]):
+                # an inner scope already holds a savepoint on this alias
+                return
+            # creating a savepoint opens a cursor too
+            self.opening = True
+            start = time.perf_counter()
+            try:
+                self.create(self.current, alias)
+            finally:
+                self.opening = False
+                self.timings['savepoint'] += time.perf_counter() - start
+
+    @contextmanager
+    def scope(self, node):
+        """Route database access to the layer of ``node``, yield the aliases
+        touched meanwhile
+        """
+        previous, self.current = self.current, node
+        touched, self.touched = self.touched, set()
+        try:
+            yield self.touched
+        finally:
+            self.current, self.touched = previous, touched
+
+    def push(self, node):
+        node.savepoints = {}
+        self.layers.append(node)
+        self.current = node
+
+    def pop(self, node):
+        # requests of a live server may be using the connections meanwhile
+        with CONNECTION_LOCK:
+            self.layers.remove(node)
+            if self.current is node:
+                self.current = self.layers[-1] if self.layers else None
+            start = time.perf_counter()
+            # outermost active layer and aliases whose data got lost
+            depth, restarted = len(self.layers), set()
+            finish = []
+            # rolling back opens cursors too, possibly on aliases the running
+            # test didn't declare when an outer scope is left
+            self.opening = True
+            try:
+                while node.savepoints:
+                    alias, sid = node.savepoints.popitem()
+                    stack = self.stacks[alias]
+                    del stack[stack.index(node):]
+                    if not self.rollback(alias, sid):
+                        parent = self.recover(node, alias)
+                        if parent is None:
+                            depth = 0
+                            restarted.add(alias)
+                        else:
+                            depth = min(depth, self.layers.index(parent))
+                # data of setups of outer scopes is gone along with the layer
+                finish.extend(fin for alias, owner, fin in reversed(self.setups.pop(node, []))
+                              if owner is not node)
+                if depth < len(self.layers) or restarted:
+                    finish.extend(self.rebuild(node, depth, restarted))
+            finally:
+                self.opening = False
+                self.timings['rollback'] += time.perf_counter() - start
+        for fin in finish:
+            fin()
+
+    def holder(self, alias):
+        """Layer data written to ``alias`` right now ends up in, the
+        innermost one with a savepoint on it
+        """
+        stack = self.stacks.get(alias)
+        return stack[-1] if stack else None
+
+    def create(self, node, alias):
+        node.savepoints[alias] = transaction.savepoint(using=alias)
+        self.stacks.setdefault(alias, []).append(node)
+
+    def rollback(self, alias, sid):
+        """Rollback to savepoint ``sid``, return whether it was still there"""
+        # the failed atomic block is left along with the savepoint
+        connections[alias].needs_rollback = False
+        try:
+            transaction.savepoint_rollback(sid, using=alias)
+        except DatabaseError:
+            return False
+        return True
+
+    def add_setup(self, alias, owner, finish):
+        """Call ``finish`` once the data the setup of ``owner`` just wrote
+        to ``alias`` is rolled back and ``owner`` is still active
+        """
+        self.setups.setdefault(self.holder(alias), []).append((alias, owner, finish))
+
+    def recover(self, node, alias):
+        """Rollback to the nearest valid savepoint of ``alias``, return the
+        layer holding it or None when the session transaction had to be
+        started over.
+        """
+        stack = self.stacks[alias]
+        while stack:
+            parent = stack[-1]
+            if self.rollback(alias, parent.savepoints[alias]):
+                self.recoveries.append([node.nodeid, alias, parent.nodeid])
+                return parent
+            stack.pop().savepoints.pop(alias)
+        connection = connections[alias]
+        end_session_transaction(connection)
+        begin_session_transaction(connection)
+        self.recoveries.append([node.nodeid, alias, 'session transaction'])
+        return None
+
+    def rebuild(self, node, depth, restarted):
+        """Rollback every alias to the savepoint of the outermost layer
+        from ``depth`` on, savepoints within it are created again lazily.
+        Return finishers of setups of those layers and of session
+        transactions ``restarted``.
+        """
+        while True:
+            rebuilt = self.layers[depth:]
+            for alias, stack in self.stacks.items():
+                held = [layer for layer in stack if layer in rebuilt]
+                if not held:
+                    continue
+                first = stack.index(held[0])
+                for layer in stack[first + 1:]:
+                    layer.savepoints.pop(alias)
+                del stack[first + 1:]
+                if self.rollback(alias, stack[first].savepoints[alias]):
+                    continue
+                stack.pop().savepoints.pop(alias)
+                parent = self.recover(node, alias)
+                if parent is None:
+                    restarted.add(alias)
+                outer = self.layers.index(parent) if parent is not None else 0
+                if outer < depth:
+                    # lost data of more layers, start over with them
+                    depth = outer
+                    break
+            else:
+                break
+        finish = []
+        for layer in reversed(rebuilt):
+            finish.extend(fin for alias, owner, fin in reversed(self.setups.pop(layer, [])))
+        session = self.setups.pop(None, [])
+        finish.extend(fin for alias, owner, fin in reversed(session) if alias in restarted)
+        session = [setup for setup in session if setup[0] not in restarted]
+        if session:
+            self.setups[None] = session
+        return finish
+
+    def pop_recoveries(self):
+        recoveries, self.recoveries = self.recoveries, []
+        return recoveries
+
+    def reset_timings(self):
+        timings = self.timings
+        self.timings = {'savepoint': 0.0, 'rollback': 0.0}
+        return timings
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""xdist scheduling balanced by test durations of previous runs."""
+
+from xdist.scheduler import LoadScopeScheduling
+
+
+TRANSACTION_SCOPE = 'pydjango:transaction'
+
+
+class DurationScheduling(LoadScopeScheduling):
+    """Distribute work units longest expected first.
+
+    Tests are grouped by module or class like ``--dist=loadscope`` does.
+    Transaction tests known from previous runs form a single work unit, so
+    they run on one worker and never force database restores on workers
+    running savepoint isolated tests.
+    """
+
+    def __init__(self, config, log=None, durations=None):
+        super(DurationScheduling, self).__init__(config, log)
+        self.durations = durations or {}
+        known = [entry['duration'] for entry in self.durations.values()]
+        # tests without history are expected to take an average time
+        self.default_duration = sum(known) / len(known) if known else 1.0
+        self.ordered = False
+
+    def _split_scope(self, nodeid):
+        if self.durations.get(nodeid, {}).get('transaction'):
+            return TRANSACTION_SCOPE
+        return super(DurationScheduling, self)._split_scope(nodeid)
+
+    def expected_duration(self, work_unit):
+        return sum(self.durations.get(nodeid, {}).get('duration', self.default_duration)
+                   for nodeid in work_unit)
+
+    def _assign_work_unit(self, node):
+        if not self.ordered:
+            work_units = sorted(self.workqueue.items(),
+                                key=lambda item: self.expected_duration(item[1]),
+                                reverse=True)
+            self.workqueue.clear()
+            self.workqueue.update(work_units)
+            self.ordered = True
+        super(DurationScheduling, self)._assign_work_unit(node)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Test database schema without migrations, and checks of migrated ones.
+
+With migrations disabled ``migrate --run-syncdb`` creates tables straight
+from current models. A job running with migrations can verify they still
+produce what the models describe, so skipping them stays safe.
+"""
+
+from django.apps import apps
+from django.db import connections, router
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.state import ProjectState
+
+
+class DisableMigrations(object):
+    """``MIGRATION_MODULES`` value treating every app as unmigrated"""
+
+    def __contains__(self, app_label):
+        return True
+
+    def __getitem__(self, app_label):
+        return None
+
+
+def missing_migrations(connection):
+    """Return descriptions of model changes no migration covers"""
+    loader = MigrationLoader(connection, ignore_no_migrations=True)
+    autodetector = MigrationAutodetector(loader.project_state(), ProjectState.from_apps(apps))
+    changes = autodetector.changes(graph=loader.graph)
+    return ['%s: %s' % (app_label, operation.describe())
+            for app_label, migrations in sorted(changes.items())
+            for migration in migrations
+            for operation in migration.operations]
+
+
+def schema_differences(connection):
+    """Compare tables and columns of the database with the models"""
+    differences = []
+    introspection = connection.introspection
+    with connection.cursor() as cursor:
+        tables = set(introspection.table_names(cursor))
+        for model in apps.get_models(include_auto_created=True):
+            opts = model._meta
+            if not opts.managed or opts.proxy or not router.allow_migrate_model(connection.alias, model):
+                continue
+            if opts.db_table not in tables:
+                differences.append('table %s of %s is missing' % (opts.db_table, opts.label))
+                continue
+            columns = dict((column.name, column) for column in
+                           introspection.get_table_description(cursor, opts.db_table))
+            fields = [field for field in opts.local_concrete_fields if field.db_parameters(connection)['type']]
+            for field in fields:
+                column = columns.pop(field.column, None)
+                if column is None:
+                    differences.append('column %s.%s of %s is missing' % (
+                        opts.db_table, field.column, field.name))
+                elif bool(column.null_ok) != field.null and not field.primary_key:
+                    differences.append('column %s.%s is %s, %s.%s is not' % (
+                        opts.db_table, field.column, 'nullable' if column.null_ok else 'not null',
+                        opts.label, field.name))
+            for name in sorted(columns):
+                differences.append('column %s.%s has no field in %s' % (opts.db_table, name, opts.label))
+    return differences
+
+
+def verify_schema():
+    """Return problems of migrated test databases, per alias"""
+    problems = {}
+    for alias in connections:
+        connection = connections[alias]
+        if connection.settings_dict.get('TEST', {}).get('MIRROR'):
+            continue
+        found = missing_migrations(connection) + schema_differences(connection)
+        if found:
+            problems[alias] = found
+    return problems
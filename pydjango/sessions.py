@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Sessions of logged in users for test clients.
+
+Instead of going through ``login()`` for every test, a session holding
+what ``login()`` would store is set up once per user and its cookie is
+attached to fresh clients.
+"""
+
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.sessions.backends.base import CreateError
+
+
+AUTH_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+DB_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+CACHE_ENGINE = 'django.contrib.sessions.backends.cache'
+SIGNED_COOKIES_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+SESSION_ENGINES = DB_ENGINES + (CACHE_ENGINE, SIGNED_COOKIES_ENGINE)
+
+
+class SessionSeeder(object):
+    """Session keys of logged in users, created once per user.
+
+    Signed cookie sessions are reused as they are, cache sessions as long
+    as the cache still has them. Database sessions are rolled back with
+    the test which saved them, so they get saved again under the same key.
+    """
+
+    def __init__(self):
+        # (engine, user pk, session auth hash) -> session key
+        self.keys = {}
+
+    def supports(self):
+        return settings.SESSION_ENGINE in SESSION_ENGINES
+
+    def session_key(self, user, backend=AUTH_BACKEND):
+        engine = settings.SESSION_ENGINE
+        key = (engine, user.pk, user.get_session_auth_hash())
+        session_key = self.keys.get(key)
+        store = import_module(engine).SessionStore
+        if session_key is not None:
+            if engine == SIGNED_COOKIES_ENGINE:
+                return session_key
+            if engine == CACHE_ENGINE and store().exists(session_key):
+                return session_key
+        session = store()
+        session.update({
+            SESSION_KEY: user._meta.pk.value_to_string(user),
+            BACKEND_SESSION_KEY: backend,
+            HASH_SESSION_KEY: user.get_session_auth_hash(),
+        })
+        if session_key is not None:
+            # set after update() so the old session isn't loaded first
+            session._session_key = session_key
+        try:
+            session.save(must_create=True)
+        except CreateError:
+            # still there, e.g. saved by a transaction test
+            session.save()
+        self.keys[key] = session.session_key
+        return session.session_key
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Ways to restore the test database after transaction tests.
+
+Both get the tables transaction tests wrote to and leave databases
+nobody wrote to alone. ``flush`` truncates the written tables and
+resets their sequences. ``snapshot`` takes a copy of the freshly set up
+databases once and restores it afterwards: SQLite databases are copied
+with the backup API, other backends get the data of the written tables
+reinserted, along with the tables emptied by the cascade of truncating
+them.
+"""
+
+import sqlite3
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connections
+
+from .db_reuse import begin_session_transaction, end_session_transaction
+
+
+def truncate_tables(connection, tables):
+    sql_list = connection.ops.sql_flush(no_style(), sorted(tables),
+                                        reset_sequences=True, allow_cascade=True)
+    connection.ops.execute_sql_flush(sql_list)
+
+
+class Flush(object):
+
+    def take(self):
+        pass
+
+    def restore(self, dirty_tables):
+        for db, tables in dirty_tables.items():
+            connection = connections[db]
+            existing = set(connection.introspection.django_table_names(
+                only_existing=True, include_views=False))
+            truncate_tables(connection, tables & existing)
+            # just like flush does, recreate content types, permissions, ...
+            emit_post_migrate_signal(verbosity=0, interactive=False, db=db)
+
+
+class SQLiteImage(object):
+    """Copy of a SQLite database kept in memory"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.image = sqlite3.connect(':memory:', check_same_thread=False)
+        connection.ensure_connection()
+        connection.connection.backup(self.image)
+
+    def restore(self, tables):
+        # the backup API refuses to write into a database in a transaction
+        end_session_transaction(self.connection)
+        self.image.backup(self.connection.connection)
+        begin_session_transaction(self.connection)
+
+
+class TableDump(object):
+    """Rows of every django table recorded in memory"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.tables = {}
+        # table -> tables with foreign keys to it
+        self.referencing = {}
+        qn = connection.ops.quote_name
+        introspection = connection.introspection
+        tables = introspection.django_table_names(only_existing=True, include_views=False)
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute('SELECT * FROM %s' % qn(table))
+                columns = [column[0] for column in cursor.description]
+                self.tables[table] = (columns, cursor.fetchall())
+                for column, (other_column, other_table) in introspection.get_relations(
+                        cursor, table).items():
+                    self.referencing.setdefault(other_table, set()).add(table)
+
+    def cascade(self, tables):
+        """``tables`` and every table truncating them empties too"""
+        found, pending = set(), list(tables)
+        while pending:
+            table = pending.pop()
+            if table not in found:
+                found.add(table)
+                pending.extend(self.referencing.get(table, ()))
+        return found
+
+    def restore(self, tables):
+        connection = self.connection
+        qn = connection.ops.quote_name
+        tables = self.cascade(tables & set(self.tables)) & set(self.tables)
+        truncate_tables(connection, tables)
+        with connection.constraint_checks_disabled(), connection.cursor() as cursor:
+            for table in tables:
+                columns, rows = self.tables[table]
+                if not rows:
+                    continue
+                cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+                    qn(table),
+                    ', '.join(qn(column) for column in columns),
+                    ', '.join(['%s'] * len(columns))
+                ), rows)
+            models = [model for model in apps.get_models(include_auto_created=True)
+                      if model._meta.db_table in tables and self.tables[model._meta.db_table][1]]
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+
+class Snapshot(object):
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def take(self):
+        for db in connections:
+            connection = connections[db]
+            if connection.vendor == 'sqlite':
+                self.snapshots[db] = SQLiteImage(connection)
+            else:
+                self.snapshots[db] = TableDump(connection)
+
+    def restore(self, dirty_tables):
+        for db, tables in dirty_tables.items():
+            self.snapshots[db].restore(tables)
+
+
+def database_snapshot(method):
+    if method == 'snapshot':
+        return Snapshot()
+    return Flush()
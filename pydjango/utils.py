@@ -8,3 +8,23 @@ def nop(*args, **kwargs):
 
 def is_transaction_test(cls):
     return issubclass(cls, TransactionTestCase) and not issubclass(cls, TestCase)
+
+
+def get_worker_id(config):
+    """Return the id of the xdist worker running this process, if any"""
+    workerinput = getattr(config, 'workerinput', None) or getattr(config, 'slaveinput', {})
+    return workerinput.get('workerid', workerinput.get('slaveid', ''))
+
+
+def get_worker_index(config):
+    """Return the index of this xdist worker and the number of workers"""
+    workerinput = getattr(config, 'workerinput', None) or getattr(config, 'slaveinput', {})
+    worker_id = get_worker_id(config)
+    if not worker_id:
+        return 0, 1
+    return int(worker_id.lstrip('gw')), int(workerinput.get('workercount', 1))
+
+
+def is_xdist_controller(config):
+    """Return whether this process distributes tests to xdist workers"""
+    return not get_worker_id(config) and getattr(config.option, 'dist', 'no') != 'no'
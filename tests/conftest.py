@@ -2,12 +2,19 @@
 
 import os
 
+import pytest
+
 SETTINGS = {
     'DATABASES': {
         'default': {
             'ENGINE': 'django.db.backends.' + os.environ.get('DB', 'sqlite3'),
             'NAME': 'pydjango',
-        }
+        },
+        'other': {
+            'ENGINE': 'django.db.backends.' + os.environ.get('DB', 'sqlite3'),
+            'NAME': 'pydjango_other',
+            'TEST': {'DEPENDENCIES': []},
+        },
     },
     'SITE_ID': 1,
     'SECRET_KEY': '*_1cc9n+lc@l$#hmd-)#(@0-i=@jbzb2zkmbv8nvf)qodq37^l',
@@ -23,11 +30,14 @@ SETTINGS = {
 }
 
 
-def pytest_configure(config, __multicall__):
+# settings have to be configured before pydjango sets up django
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
     from django.conf import settings
     if not settings.configured:
         if 'TRAVIS' in os.environ:
-            SETTINGS['DATABASES']['default']['HOST'] = '127.0.0.1'
-            SETTINGS['DATABASES']['default']['PASSWORD'] = ''
+            for database in SETTINGS['DATABASES'].values():
+                database['HOST'] = '127.0.0.1'
+                database['PASSWORD'] = ''
 
         settings.configure(**SETTINGS)
@@ -35,6 +35,27 @@ class TestTestCase(TestCase):
         assert User.objects.count() == 1
 
 
+class TestTestData(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(username='test_data', email='data@example.com')
+
+    def test_data_method(self):
+        User.objects.create(username='data_method', email='method@example.com')
+        assert User.objects.count() == 3
+
+    def test_data_second_method(self):
+        assert User.objects.count() == 2
+
+
+def test_testcase_savepoints(request):
+    # item layers of TestCase tests are left before tearDownClass rolls back
+    # the atomic block they are in, nothing had to be recovered
+    plugin = request.config.pluginmanager.get_plugin('_pydjango')
+    assert not [nodeid for nodeid, alias, target in plugin.recoveries if '::TestTest' in nodeid]
+
+
 class TestTransaction(TransactionTestCase):
 
     def test_trans_method(self):
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+from django.contrib.auth.models import User
+
+USERS = os.path.join(os.path.dirname(__file__), 'fixtures', 'users.json')
+
+pytestmark = pytest.mark.django_fixtures(USERS, scope='module')
+
+
+@pytest.mark.parametrize('attempt', range(2))
+def test_module_fixtures(attempt):
+    assert User.objects.filter(groups__name='editors').count() == 2
+    User.objects.all().delete()
+
+
+@pytest.mark.django_fixtures(USERS)
+def test_loaded_once_per_scope():
+    assert User.objects.count() == 2
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from pydjango.dirty_tables import written_table
+
+
+@pytest.mark.parametrize(('sql', 'table'), [
+    ('INSERT INTO "auth_user" ("username") VALUES (%s)', 'auth_user'),
+    ('UPDATE "auth_user" SET "email" = %s', 'auth_user'),
+    ('DELETE FROM `auth_group` WHERE `id` = %s', 'auth_group'),
+    ('SELECT "auth_user"."id" FROM "auth_user"', None),
+])
+def test_written_table(sql, table):
+    assert written_table(sql) == table
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import Group
+from django.db import connection, connections, models
+
+from pydjango.fingerprint import (reuse_strategy, fresh_fingerprint, schema_cache_key,
+                                  FINGERPRINT_TABLE, REUSE, REBUILD)
+
+
+def test_reuse_strategy():
+    assert reuse_strategy(connection) == REUSE
+
+
+def test_rebuild_without_fingerprint():
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % connection.ops.quote_name(FINGERPRINT_TABLE))
+    assert reuse_strategy(connection) == REBUILD
+
+
+def test_fingerprint_covers_model_options(monkeypatch):
+    fingerprint = fresh_fingerprint(connection)
+    monkeypatch.setattr(Group._meta, 'indexes', [models.Index(fields=['name'], name='group_name')])
+    with_index = fresh_fingerprint(connection)
+    assert with_index != fingerprint
+    monkeypatch.setattr(Group._meta, 'constraints', [
+        models.CheckConstraint(condition=~models.Q(name=''), name='group_name_set')])
+    with_constraint = fresh_fingerprint(connection)
+    assert with_constraint != with_index
+    monkeypatch.setattr(Group._meta, 'unique_together', (('id', 'name'), ))
+    assert fresh_fingerprint(connection) != with_constraint
+
+
+def test_schema_cache_key():
+    fingerprint = fresh_fingerprint(connection)
+    assert schema_cache_key(connections['default'], fingerprint) != \
+        schema_cache_key(connections['other'], fingerprint)
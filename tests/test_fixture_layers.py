@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+from django.contrib.auth.models import User
+
+USERS = os.path.join(os.path.dirname(__file__), 'fixtures', 'users.json')
+
+
+@pytest.fixture(scope='module')
+def module_user():
+    return User.objects.create(username='module', email='module@example.com')
+
+
+class TestClassHoldsSavepoint(object):
+
+    @classmethod
+    def setup_class(cls):
+        User.objects.create(username='class', email='class@example.com')
+
+    def test_class_savepoint(self):
+        assert User.objects.count() == 1
+
+    @pytest.mark.django_fixtures(USERS, scope='module')
+    def test_module_fixtures_in_class(self):
+        # the class layer holds the savepoint, the rows land in it
+        assert User.objects.count() == 3
+
+    def test_module_fixture_in_class(self, module_user):
+        assert User.objects.filter(username='module').exists()
+
+
+@pytest.mark.django_fixtures(USERS, scope='module')
+def test_module_fixtures_after_class(module_user):
+    # rolled back with the class layer, so set up again
+    assert sorted(User.objects.values_list('username', flat=True)) == ['editor1', 'editor2', 'module']
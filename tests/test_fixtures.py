@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import pytest
+
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 def test_client(client):
@@ -21,11 +25,29 @@ def test_admin_user(admin_user):
     assert admin_user.pk
 
 
+@pytest.mark.parametrize('name', ['test_user', 'admin_user'])
+def test_user_created_at_once(request, name):
+    with CaptureQueriesContext(connection) as queries:
+        user = request.getfixturevalue(name)
+    writes = [query['sql'].split()[0] for query in queries
+              if query['sql'].startswith(('INSERT', 'UPDATE'))]
+    assert writes == ['INSERT']
+    assert user.check_password(user.username)
+
+
 def test_uclient(uclient, settings):
     assert uclient.user
     assert uclient.cookies[settings.SESSION_COOKIE_NAME]
 
 
+def test_uclient_session(uclient, settings):
+    from django.contrib.auth import SESSION_KEY
+    from django.contrib.sessions.backends.db import SessionStore
+    session_key = uclient.cookies[settings.SESSION_COOKIE_NAME].value
+    assert SessionStore(session_key)[SESSION_KEY] == str(uclient.user.pk)
+    assert uclient.session[SESSION_KEY] == str(uclient.user.pk)
+
+
 def test_aclient(aclient):
     from django.core.urlresolvers import reverse
     response = aclient.get(reverse('admin:index'))
@@ -14,3 +14,46 @@ def test_after_liveserver():
     "shouldnt have any users in db"
     from django.contrib.auth.models import User
     assert User.objects.count() == 0
+
+
+def test_worker_ports():
+    from pydjango.live_server_helper import LiveServerThread
+    assert LiveServerThread(None, 'localhost:8081-8089', 1, 4).possible_ports == [8082, 8086]
+    assert LiveServerThread(None, 'localhost:8081', 1, 4).possible_ports == [0]
+
+
+def test_ephemeral_port(live_server):
+    assert live_server.thread.port
+    assert live_server.url.endswith(':%d' % live_server.thread.port)
+
+
+def test_connection_lock():
+    import threading
+    import time
+    from django.contrib.auth.models import User
+    from pydjango.live_server_helper import ConnectionLock
+    lock = ConnectionLock()
+    lock.install()
+    served, release = threading.Event(), threading.Event()
+
+    def request():
+        lock.start_request()
+        try:
+            User.objects.count()
+            served.set()
+            release.wait(5)
+        finally:
+            lock.finish_request()
+    thread = threading.Thread(target=request)
+    thread.start()
+    try:
+        assert served.wait(5)
+        threading.Timer(0.2, release.set).start()
+        start = time.perf_counter()
+        # the test thread waits for the request holding the connection
+        User.objects.count()
+        assert time.perf_counter() - start >= 0.15
+    finally:
+        release.set()
+        thread.join()
+        lock.uninstall()
@@ -12,6 +12,19 @@ def test_module_setup(attempt):
     assert User.objects.count() == 1
 
 
+@pytest.fixture(scope='module')
+def module_user():
+    from django.contrib.auth.models import User
+    return User.objects.create(username='module_user', email='module@example.com')
+
+
+@pytest.mark.parametrize('attempt', range(2))
+def test_module_fixture(module_user, attempt):
+    from django.contrib.auth.models import User
+    assert User.objects.count() == 2
+    User.objects.create(username='attempt%s' % attempt)
+
+
 # this one crashes python but only with sqlite
 # from django.core.urlresolvers import reverse
 # @pytest.mark.parametrize('longattr', range(160))
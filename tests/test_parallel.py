@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from django.core import management
+from django.test.utils import get_unique_databases_and_mirrors
+
+from pydjango.parallel import serialized_commands, setup_waves
+
+
+def test_independent_aliases():
+    test_databases, mirrors = get_unique_databases_and_mirrors()
+    waves = setup_waves(test_databases.values())
+    assert [sorted(aliases[0] for db_name, aliases in wave) for wave in waves] == [['default', 'other']]
+
+
+def test_serialized_commands(monkeypatch):
+    running, overlaps = [], []
+
+    def call_command(*args, **kwargs):
+        running.append(args)
+        overlaps.append(len(running))
+        time.sleep(0.05)
+        running.remove(args)
+    monkeypatch.setattr(management, 'call_command', call_command)
+    with serialized_commands():
+        threads = [threading.Thread(target=management.call_command, args=('migrate', alias))
+                   for alias in ('default', 'other')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert overlaps == [1, 1]
+    assert management.call_command is call_command
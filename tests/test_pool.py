@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+from pydjango.pool import DatabasePool, pool_postfix
+
+
+def test_pool_slots(tmpdir):
+    first = DatabasePool(str(tmpdir), 2)
+    second = DatabasePool(str(tmpdir), 2)
+    assert first.claim() == 0
+    assert second.claim() == 1
+    first.release()
+    assert DatabasePool(str(tmpdir), 2).claim() == 0
+
+
+def test_pool_postfix():
+    assert pool_postfix(3) == '_p3'
+    assert pool_postfix(3, 'gw0') == '_p3_gw0'
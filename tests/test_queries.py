@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from pydjango.queries import query_shape, is_savepoint_sql, QueryStats, REPEATED
+
+
+def test_query_shape():
+    assert query_shape("SELECT * FROM t WHERE a = 'x' AND b = 10") == \
+        "SELECT * FROM t WHERE a = ? AND b = ?"
+    assert query_shape('SELECT * FROM t WHERE id IN (%s, %s, %s)') == \
+        'SELECT * FROM t WHERE id IN (...)'
+
+
+def test_savepoint_sql():
+    assert is_savepoint_sql('SAVEPOINT "s1_x1"')
+    assert is_savepoint_sql('ROLLBACK TO SAVEPOINT "s1_x1"')
+    assert not is_savepoint_sql('SELECT 1')
+
+
+def test_repeated_queries():
+    stats = QueryStats('test')
+    for pk in range(REPEATED):
+        stats.add('SELECT * FROM t WHERE id = %d' % pk, 0.1)
+    stats.add('SELECT 1', 0.5)
+    stats.compact()
+    assert stats.count == REPEATED + 1
+    assert list(stats.shapes) == ['SELECT * FROM t WHERE id = ?']
+    assert stats.as_dict()['slowest'][0]['sql'] == 'SELECT 1'
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from django.contrib.auth.models import User
+
+
+@pytest.mark.max_queries(1)
+def test_max_queries():
+    assert User.objects.count() == 0
+
+
+def test_query_budget(query_budget):
+    with query_budget(1) as queries:
+        User.objects.count()
+    assert len(queries) == 1
+
+
+def test_query_budget_exceeded(query_budget):
+    with pytest.raises(pytest.fail.Exception) as exc:
+        with query_budget(0):
+            User.objects.count()
+    assert 'SELECT COUNT(*)' in str(exc.value)
@@ -3,8 +3,11 @@
 import pytest
 
 from django.contrib.auth.models import User
+from django.db import connection, transaction, DatabaseError, IntegrityError, InternalError
+from django.db.transaction import TransactionManagementError
 from django.test.testcases import TestCase, TransactionTestCase
-from pydjango.patches import Function, Class, Instance
+
+from pydjango.savepoints import DatabaseNotDeclared
 
 def test_no_savepoints(request):
     "no fixtures and no setup_module so shouldnt have savepoints"
@@ -35,7 +38,7 @@ class TestClassLazySavepoint(object):
         assert User.objects.count() == 2
         assert request.node.savepoints
         for node in request.node.listchain():
-            if isinstance(node, (Function, Class, Instance)):
+            if isinstance(node, (pytest.Function, pytest.Class)):
                 assert node.savepoints
 
 
@@ -51,7 +54,7 @@ class TestCaceLazySavepoint(TestCase):
         User.objects.create(username='test2', password='pass')
         assert self.request.node.savepoints
         for node in self.request.node.listchain():
-            if isinstance(node, (Function, Class, Instance)):
+            if isinstance(node, (pytest.Function, pytest.Class)):
                 assert node.savepoints
 
 @pytest.mark.usefixtures("classrequest")
@@ -60,3 +63,65 @@ class TestTransactionSavepoints(TransactionTestCase):
         User.objects.create(username='test2', password='pass')
         for node in self.request.node.listchain():
             assert not getattr(node, 'savepoints', {}), node.cls
+
+
+@pytest.mark.django_db(databases=['default'])
+def test_declared_databases(request):
+    User.objects.create(username='test', password='pass')
+    assert list(request.node.savepoints) == ['default']
+
+
+@pytest.mark.django_db(databases=['default'])
+def test_undeclared_database(request):
+    with pytest.raises(DatabaseNotDeclared):
+        User.objects.using('other').count()
+    assert not request.node.savepoints
+
+
+def test_every_database(request):
+    User.objects.using('other').create(username='other', password='pass')
+    assert list(request.node.savepoints) == ['other']
+    assert User.objects.using('other').count() == 1
+    assert User.objects.count() == 0
+
+
+def test_other_database_rolled_back():
+    assert User.objects.using('other').count() == 0
+
+
+class TestSavepointRecovery(object):
+
+    @classmethod
+    def setup_class(cls):
+        User.objects.create(username='class', password='pass')
+        User.objects.using('other').create(username='class', password='pass')
+
+    def test_released_savepoint(self, request):
+        User.objects.create(username='test', password='pass')
+        transaction.savepoint_commit(request.node.savepoints['default'])
+
+    def test_recovered_savepoint(self, request):
+        # rolled back to the class savepoint instead and setup_class ran again
+        assert list(User.objects.values_list('username', flat=True)) == ['class']
+        assert list(User.objects.using('other').values_list('username', flat=True)) == ['class']
+        assert 'default' in request.node.getparent(pytest.Class).savepoints
+
+    def test_broken_transaction(self):
+        with pytest.raises(IntegrityError):
+            with transaction.atomic(savepoint=False):
+                User.objects.create(username='class', password='pass')
+        # like an aborted PostgreSQL transaction, nothing but a rollback works
+        with pytest.raises(TransactionManagementError):
+            User.objects.count()
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='PostgreSQL aborts transactions')
+    def test_aborted_transaction(self):
+        with connection.cursor() as cursor:
+            with pytest.raises(DatabaseError):
+                cursor.execute('SELECT 1 / 0')
+            with pytest.raises(InternalError):
+                cursor.execute('SELECT 1')
+
+    def test_class_data_kept(self):
+        assert list(User.objects.values_list('username', flat=True)) == ['class']
+        assert list(User.objects.using('other').values_list('username', flat=True)) == ['class']
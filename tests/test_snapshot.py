@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import Group, User
+from django.db import connection
+
+from pydjango.snapshot import TableDump
+
+
+def test_table_dump_restores_cascaded_tables():
+    group = Group.objects.create(name='group')
+    user = User.objects.create(username='user')
+    user.groups.add(group)
+    dump = TableDump(connection)
+    Group.objects.create(name='written')
+    # emptying auth_group cascades to auth_user_groups, which wasn't written
+    dump.restore({'auth_group'})
+    assert list(Group.objects.values_list('name', flat=True)) == ['group']
+    assert list(user.groups.all()) == [group]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from django.test.testcases import TransactionTestCase
+
+calls = []
+
+
+def setup_module():
+    calls.append(1)
+
+
+def test_savepoint_isolated():
+    assert calls == [1]
+
+
+class TestTransaction(TransactionTestCase):
+
+    def test_transaction(self):
+        assert calls == [1]
+
+
+def test_after_transaction_class():
+    assert calls == [1]